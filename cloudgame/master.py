@@ -5,7 +5,10 @@ import random
 from typing import List, Dict
 import logging
 import numpy as np
+import sys
 
+sys.path.append(os.path.abspath('../clemgames'))
+import image_cache
 import clemcore.clemgame.metrics as ms
 from clemcore.clemgame import GameBenchmark, DialogueGameMaster, GameScorer, GameSpec
 from clemcore.clemgame import Player
@@ -20,6 +23,10 @@ class Speaker(Player):
     def __init__(self, backend: Model):
         super().__init__(backend)  
 
+    def __call__(self, messages, turn_idx):
+        # the history keeps the original images, the model gets the prepared copies
+        return super().__call__(image_cache.prepare_messages(messages, self.model), turn_idx)
+
     def _custom_response(self, messages, turn_idx) -> str:
         """Return yes or no randomly."""
         k = random.randint(0, 1)   
@@ -0,0 +1,54 @@
+"""
+Shortest path lengths on the small room graphs of the map games.
+
+Shared by textmapworld (new framework) and textmapworld_questions (old
+framework), so it only depends on numpy. Import it like the other shared
+modules (sys.path.append(os.path.abspath('../clemgames')), then
+import graph_distances) or, in the old framework, as games.graph_distances.
+"""
+import numpy as np
+
+
+class DistanceTable:
+    """
+    All-pairs shortest path lengths of a graph as a small NumPy matrix (-1 for unreachable pairs),
+    computed with one BFS per node. Answers distance(u, v) and "nodes at distance d" without building a networkx graph.
+    """
+
+    def __init__(self, nodes, edges):
+        self.nodes = list(nodes)
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        for edge in edges:
+            for node in edge:
+                if node not in self.node_index:
+                    self.node_index[node] = len(self.nodes)
+                    self.nodes.append(node)
+        neighbours = [[] for _ in self.nodes]
+        for node1, node2 in edges:
+            neighbours[self.node_index[node1]].append(self.node_index[node2])
+            neighbours[self.node_index[node2]].append(self.node_index[node1])
+        self.matrix = np.full((len(self.nodes), len(self.nodes)), -1, dtype=np.int16)
+        for source in range(len(self.nodes)):
+            row = self.matrix[source]
+            row[source] = 0
+            frontier = [source]
+            while frontier:
+                next_frontier = []
+                for node in frontier:
+                    for neighbour in neighbours[node]:
+                        if row[neighbour] < 0:
+                            row[neighbour] = row[node] + 1
+                            next_frontier.append(neighbour)
+                frontier = next_frontier
+
+    @classmethod
+    def from_graph(cls, graph):
+        return cls(graph.nodes(), graph.edges())
+
+    def distance(self, node1, node2):
+        "Length of the shortest path between the nodes, None if there is no path"
+        distance = self.matrix[self.node_index[node1], self.node_index[node2]]
+        return None if distance < 0 else int(distance)
+
+    def nodes_at_distance(self, node, distance):
+        return [self.nodes[i] for i in np.flatnonzero(self.matrix[self.node_index[node]] == distance)]
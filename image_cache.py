@@ -0,0 +1,109 @@
+"""
+Resized derivatives of the images that multimodal games send to the models.
+
+Backends load and encode every image path of a message on every request,
+so instead of the (often very large) original the games pass a downscaled
+JPEG copy. Copies are created once per source content and size, stored
+under CACHE_DIR with a content hash in their name and reused by all later
+turns, episodes and runs.
+
+Usage from a game (same as the other shared modules):
+
+    sys.path.append(os.path.abspath('../clemgames'))
+    import image_cache
+
+    # in the Player that queries the model, the message history keeps the originals
+    def __call__(self, messages, turn_idx):
+        return super().__call__(image_cache.prepare_messages(messages, self.model), turn_idx)
+"""
+import os
+import hashlib
+from functools import lru_cache
+from PIL import Image
+
+# longest side and JPEG quality of the copies sent to a model
+DEFAULT_MAX_SIDE = 1024
+DEFAULT_QUALITY = 85
+# per model overrides: model name -> (max side, quality)
+MODEL_IMAGE_SIZES = {}
+
+CACHE_DIR = os.environ.get(
+    "CLEMGAMES_IMAGE_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "clemgames", "images")
+)
+
+
+def image_settings(model = None):
+    """ returns the (max side, quality) used for the images sent to the given model """
+    if model is not None:
+        try:
+            name = model.get_name()
+        except AttributeError:
+            name = None
+        if name in MODEL_IMAGE_SIZES:
+            return MODEL_IMAGE_SIZES[name]
+    return DEFAULT_MAX_SIDE, DEFAULT_QUALITY
+
+
+@lru_cache(maxsize = 4096)
+def _file_digest(path, mtime_ns, size):
+    # mtime and size are part of the key, so a changed file is hashed again
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@lru_cache(maxsize = 4096)
+def _derivative(path, mtime_ns, size, max_side, quality):
+    digest = _file_digest(path, mtime_ns, size)
+    target = os.path.join(CACHE_DIR, f"{digest}_{max_side}_q{quality}.jpg")
+    if os.path.exists(target):
+        return target
+    with Image.open(path) as image:
+        if max(image.size) <= max_side and image.format == "JPEG":
+            # already small enough, re-encoding would only lose quality
+            return path
+        if "A" in image.getbands() or image.mode == "P":
+            # keep diagrams with transparency lossless, they are small anyway
+            return path
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        os.makedirs(CACHE_DIR, exist_ok = True)
+        # write to a temporary file first, several processes may prepare the same image
+        tmp = f"{target}.{os.getpid()}.tmp"
+        image.save(tmp, "JPEG", quality = quality, optimize = True)
+        os.replace(tmp, target)
+    return target
+
+
+def prepare_image(path, max_side = DEFAULT_MAX_SIDE, quality = DEFAULT_QUALITY):
+    """ returns the path of the resized copy of a local image,
+        anything else (urls, missing files) is returned unchanged """
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return path
+    stat = os.stat(path)
+    return _derivative(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, max_side, quality)
+
+
+def prepare_images(images, model = None):
+    """ prepares a single image path or a list of them for the given model """
+    if images is None:
+        return None
+    max_side, quality = image_settings(model)
+    if isinstance(images, (list, tuple)):
+        return [prepare_image(image, max_side, quality) for image in images]
+    return prepare_image(images, max_side, quality)
+
+
+def prepare_messages(messages, model = None):
+    """ returns the messages with the images of every message replaced by
+        their prepared copies; the given messages are not modified """
+    prepared = []
+    for message in messages:
+        if message.get("image"):
+            message = dict(message)
+            message["image"] = prepare_images(message["image"], model)
+        prepared.append(message)
+    return prepared
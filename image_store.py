@@ -0,0 +1,78 @@
+"""
+Content-addressed store for the images used by the game instances.
+
+Instance generators used to copy every dataset image into the resources
+of each game, so the same picture ended up on disk several times. Images
+are now added to a single store, named after the sha256 of their content,
+and instances reference the stored file. Files are hardlinked into the
+store where possible and only copied when the filesystem does not allow it.
+
+Usage (same as the other shared modules):
+
+    sys.path.append(os.path.abspath('../clemgames'))
+    import image_store
+
+    path = image_store.add_image(dataset_image)   # in instance generators
+    path = image_store.resolve_image(reference)   # in game masters
+"""
+import os
+import shutil
+import hashlib
+
+STORE_NAME = "image_store"
+# path written into the instances, relative to the working directory of the framework
+STORE_DIR = os.path.join("..", "clemgames", STORE_NAME)
+# the same directory, independent of the working directory
+STORE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), STORE_NAME)
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _link_or_copy(src, tgt):
+    tmp = f"{tgt}.{os.getpid()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, tgt)
+
+
+def add_image(image_path, store_dir = STORE_DIR):
+    """ adds an image to the store (if its content is not in there yet)
+        and returns the path of the stored file """
+    digest = file_hash(image_path)
+    ext = os.path.splitext(image_path)[1].lower()
+    tgt = os.path.join(store_dir, digest[:2], digest + ext)
+    if not os.path.exists(tgt):
+        os.makedirs(os.path.dirname(tgt), exist_ok = True)
+        _link_or_copy(image_path, tgt)
+    return tgt
+
+
+def link_image(image_path, tgt, store_dir = STORE_ROOT):
+    """ for games that need the image under a fixed name: adds it to the store
+        and links the stored file to tgt instead of copying it there """
+    stored = add_image(image_path, store_dir)
+    if os.path.exists(tgt):
+        os.remove(tgt)
+    _link_or_copy(stored, tgt)
+    return tgt
+
+
+def resolve_image(reference):
+    """ returns a path to the image an instance refers to. References into
+        the store are also found when the working directory is a different one """
+    if os.path.exists(reference):
+        return reference
+    parts = os.path.normpath(reference).split(os.sep)
+    if STORE_NAME in parts:
+        stored = os.path.join(STORE_ROOT, *parts[parts.index(STORE_NAME) + 1:])
+        if os.path.exists(stored):
+            return stored
+    return reference
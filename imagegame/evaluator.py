@@ -1,49 +1,101 @@
+from functools import lru_cache
+from itertools import chain
 
-def get_size(grid):
-    rows = grid.strip().split('\n')
-
-    row_size = len(rows)
-    column_size = 0
-    for r_index in range(0, len(rows)):
-        target_cells = rows[r_index].split(' ')
-        column_size = len(target_cells)
-        break
-
-    return row_size, column_size
-
-def evaluate(target, generated):
-
-    if get_size(target) != get_size(generated):
-        return 0.0, 0.0, 0.0
-
-    target_rows = target.strip().split('\n')
-    generated_rows = generated.strip().split('\n')
-
-    recall_counter = 0
-    total_recall_counter = 0
+import numpy as np
 
-    precision_counter = 0
-    total_precision_counter = 0
+EMPTY_CELL = '▢'
+# lowercased cell -> code, the empty cell is 0
+CELL_CODES = {EMPTY_CELL: 0}
 
-    for r_index in range(0, len(target_rows)):
 
-        target_cells = target_rows[r_index].split(' ')
-        generated_cells = generated_rows[r_index].split(' ')
+def cell_codes(cells):
+    """ codes of lowercased cells, new cells get the next free code """
+    codes = list(map(CELL_CODES.get, cells))
+    if None in codes:
+        for i, cell in enumerate(cells):
+            if codes[i] is None:
+                codes[i] = CELL_CODES.setdefault(cell, len(CELL_CODES))
+    return codes
 
-        for c_index in range(0, len(target_cells)):
 
-            if target_cells[c_index] != '▢':
-                total_recall_counter += 1
+@lru_cache(maxsize=4096)
+def parse_grid(grid):
+    """
+    Encode a grid string once: cells that are the same up to case get the same code
+    :param grid: grid string, rows separated by newlines and cells by spaces
+    :return: the cell codes of all rows (row-major) and the number of cells in every row
+    """
+    # lowercasing never adds spaces or newlines, so the whole grid is lowercased and split at once
+    grid = grid.strip().lower()
+    row_lengths = tuple(row.count(' ') + 1 for row in grid.split('\n'))
+    return tuple(cell_codes(grid.replace('\n', ' ').split(' '))), row_lengths
 
-                if target_cells[c_index].lower() == generated_cells[c_index].lower():
-                    recall_counter += 1
-
-            if generated_cells[c_index] != '▢':
-                total_precision_counter += 1
-
-                if target_cells[c_index].lower() == generated_cells[c_index].lower():
-                    precision_counter += 1
 
+def get_size(grid):
+    _, row_lengths = parse_grid(grid)
+    return len(row_lengths), row_lengths[0]
+
+
+def align(reference, other):
+    """
+    Pair the cells of two parsed grids along the reference grid; cells of the
+    other grid beyond the rows of the reference are ignored
+    :return: the cell codes of both grids, of the same length
+    """
+    reference_codes, reference_lengths = reference
+    other_codes, other_lengths = other
+    if reference_lengths == other_lengths:
+        return reference_codes, other_codes
+    if len(other_lengths) < len(reference_lengths):
+        raise IndexError("the grid has fewer rows than the reference grid")
+    aligned = []
+    start = 0
+    for reference_length, other_length in zip(reference_lengths, other_lengths):
+        if other_length < reference_length:
+            raise IndexError("a row of the grid is shorter than in the reference grid")
+        aligned.extend(other_codes[start:start + reference_length])
+        start += other_length
+    return reference_codes, tuple(aligned)
+
+
+def stack_pairs(pairs):
+    """ the codes of all aligned pairs as two flat arrays and the pair id of every cell """
+    lengths = [len(first) for first, _ in pairs]
+    total = sum(lengths)
+    first = np.fromiter(chain.from_iterable(first for first, _ in pairs), dtype=np.uint32, count=total)
+    second = np.fromiter(chain.from_iterable(second for _, second in pairs), dtype=np.uint32, count=total)
+    return first, second, np.repeat(np.arange(len(pairs)), lengths)
+
+
+def pair_match_counts(target, generated):
+    """ match_counts of a single aligned pair, without the overhead of arrays """
+    # a cell filled in both grids counts for recall and precision if it matches
+    matched = sum(1 for t, g in zip(target, generated) if t and t == g)
+    return matched, len(target) - target.count(0), matched, len(generated) - generated.count(0)
+
+
+def match_counts(pairs):
+    """
+    Count matching cells for many aligned (target, generated) pairs at once
+    :param pairs: list of aligned cell codes (see align)
+    :return: array with one row per pair: matched filled target cells, filled target cells,
+             matched filled generated cells, filled generated cells
+    """
+    target, generated, pair_ids = stack_pairs(pairs)
+    same = target == generated
+    target_filled = target != 0
+    generated_filled = generated != 0
+    counts = [
+        target_filled & same,
+        target_filled,
+        generated_filled & same,
+        generated_filled
+    ]
+    return np.stack([np.bincount(pair_ids, weights=count, minlength=len(pairs)) for count in counts],
+                    axis=1).astype(np.int64)
+
+
+def scores(recall_counter, total_recall_counter, precision_counter, total_precision_counter):
     recall = round(recall_counter/float(total_recall_counter), 4)
     precision = round(precision_counter / float(total_precision_counter), 4)
 
@@ -59,20 +111,76 @@ def evaluate(target, generated):
 
     return precision, recall, f1
 
-def calculate_flipped_pixels(previous, current):
-    target_rows = previous.strip().split('\n')
-    generated_rows = current.strip().split('\n')
-
-    flipped_counter = 0
 
-    for r_index in range(0, len(target_rows)):
-
-        target_cells = target_rows[r_index].split(' ')
-        generated_cells = generated_rows[r_index].split(' ')
+def evaluate(target, generated):
+    if get_size(target) != get_size(generated):
+        return 0.0, 0.0, 0.0
 
-        for c_index in range(0, len(target_cells)):
+    target = parse_grid(target)
+    generated = parse_grid(generated)
+
+    return scores(*pair_match_counts(*align(target, generated)))
+
+
+def evaluate_batch(targets, generated):
+    """
+    Score many (target, generated) grid pairs at once
+    :param targets: list of target grid strings
+    :param generated: list of generated grid strings
+    :return: list of (precision, recall, f1) per pair, as evaluate would return them;
+             None for pairs on which evaluate raises an error (malformed grids)
+    """
+    results = [None] * len(targets)
+    pairs = []
+    pair_ids = []
+    for i, (target, generated_grid) in enumerate(zip(targets, generated)):
+        if get_size(target) != get_size(generated_grid):
+            results[i] = (0.0, 0.0, 0.0)
+            continue
+        try:
+            pairs.append(align(parse_grid(target), parse_grid(generated_grid)))
+        except IndexError:
+            continue
+        pair_ids.append(i)
+    if pairs:
+        for i, counts in zip(pair_ids, match_counts(pairs)):
+            try:
+                results[i] = scores(*[int(count) for count in counts])
+            except ZeroDivisionError:
+                pass
+    return results
+
+
+def flipped_counts(pairs):
+    """
+    Count the cells that differ for many aligned (previous, current) pairs at once
+    :param pairs: list of aligned cell codes (see align)
+    :return: array with the number of changed cells per pair
+    """
+    previous, current, pair_ids = stack_pairs(pairs)
+    return np.bincount(pair_ids, weights=previous != current, minlength=len(pairs)).astype(np.int64)
 
-            if target_cells[c_index].lower() != generated_cells[c_index].lower():
-                flipped_counter += 1
 
-    return flipped_counter
+def calculate_flipped_pixels(previous, current):
+    previous, current = align(parse_grid(previous), parse_grid(current))
+    return sum(p != c for p, c in zip(previous, current))
+
+
+def calculate_flipped_pixels_batch(previous, current):
+    """
+    Count changed cells for many (previous, current) grid pairs at once
+    :return: list of counts, None for pairs on which calculate_flipped_pixels raises an error
+    """
+    results = [None] * len(previous)
+    pairs = []
+    pair_ids = []
+    for i, (previous_grid, current_grid) in enumerate(zip(previous, current)):
+        try:
+            pairs.append(align(parse_grid(previous_grid), parse_grid(current_grid)))
+        except IndexError:
+            continue
+        pair_ids.append(i)
+    if pairs:
+        for i, count in zip(pair_ids, flipped_counts(pairs)):
+            results[i] = int(count)
+    return results
@@ -11,93 +11,19 @@ import random
 
 from clemcore.clemgame import GameInstanceGenerator
 
+from resources.grid_generator import GridGenerator
+
 random.seed(123)
 N_INSTANCES = 10
+GRID_DIMENSION = 5
+# the random grid of a compact grid has its letter in at least 5 and at most
+# as many cells as the compact grid, but no more than 10
+MIN_RANDOM_GRID_LETTERS = 5
+MAX_RANDOM_GRID_LETTERS = 10
 
 logger = logging.getLogger(__name__)
 
 
-def generate_random_grid(number_of_letters, grid_dimension, fill_row=False, fill_column=False):
-    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-
-    # create an empty grid
-    grid = []
-    for i in range(0, grid_dimension):
-
-        row = []
-        for j in range(0, grid_dimension):
-            row.append('▢')
-        grid.append(row)
-
-    # randomly initialize the grid
-    for i in range(0, min(grid_dimension * grid_dimension, number_of_letters)):
-        ## select random row and column location in the grid
-        random_row_index = randint(0, grid_dimension - 1)
-        random_column_index = randint(0, grid_dimension - 1)
-
-        random_letter_index = randint(0, len(alphabet) - 1)
-        random_letter = alphabet[random_letter_index]
-
-        grid[random_row_index][random_column_index] = random_letter
-
-    # select a random row and fill it with a random letter
-    if fill_row:
-        random_row_index = randint(0, grid_dimension - 1)
-        random_letter_index = randint(0, len(alphabet) - 1)
-        random_letter = alphabet[random_letter_index]
-
-        row = []
-        for i in range(0, grid_dimension):
-            row.append(random_letter)
-
-        grid[random_row_index] = row
-
-    if fill_column:
-        random_column_index = randint(0, grid_dimension - 1)
-        random_letter_index = randint(0, len(alphabet) - 1)
-        random_letter = alphabet[random_letter_index]
-
-        for i in range(0, grid_dimension):
-
-            for j in range(0, grid_dimension):
-                if j == random_column_index:
-                    grid[i][j] = random_letter
-
-    grid_as_string = ''
-    for g_row in grid:
-        row = ''
-        for cell in g_row:
-            row += cell + ' '
-        grid_as_string += row.strip() + '\n'
-    return grid_as_string.strip()
-
-
-def generate_random_grid(number_of_letters, grid_dimension, letter):
-    # create an empty grid
-    grid = []
-    for i in range(0, grid_dimension):
-
-        row = []
-        for j in range(0, grid_dimension):
-            row.append('▢')
-        grid.append(row)
-
-    for i in range(0, min(grid_dimension * grid_dimension, number_of_letters)):
-        ## select random row and column location in the grid
-        random_row_index = randint(0, grid_dimension - 1)
-        random_column_index = randint(0, grid_dimension - 1)
-        grid[random_row_index][random_column_index] = letter
-
-
-    grid_as_string = ''
-    for g_row in grid:
-        row = ''
-        for cell in g_row:
-            row += cell + ' '
-        grid_as_string += row.strip() + '\n'
-    return grid_as_string.strip()
-
-
 class ImageGameInstanceGenerator(GameInstanceGenerator):
 
     def __init__(self):
@@ -113,30 +39,32 @@ class ImageGameInstanceGenerator(GameInstanceGenerator):
         compact_grids = []
         random_grids = []
         alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        letters = []
 
         for grid in initial_grids:
             random_letter_index = randint(0, len(alphabet) - 1)
             random_letter = alphabet[random_letter_index]
 
-            # at most 10 cells to be filled
-            letter_count = min(grid.count('X'), 10)
-            # pick a random number to decide on the number of letters to put in the random grid
-            random_grid_letter_count = randint(5, letter_count)
-
-            random_grid = generate_random_grid(random_grid_letter_count, 5, random_letter)
-
+            letters.append((random_letter, min(grid.count('X'), MAX_RANDOM_GRID_LETTERS)))
             grid = grid.replace('X', random_letter)
             alphabet = alphabet.replace(random_letter, '')
 
             compact_grids.append(grid)
-            random_grids.append(random_grid)
+
+        # distinct random grids, none of them repeats a compact grid; every random grid
+        # uses the letter of its compact grid
+        grid_generator = GridGenerator(GRID_DIMENSION, seed=123)
+        grid_generator.add_seen(compact_grids)
+        for random_letter, letter_count in letters:
+            random_grids.extend(grid_generator.random_grids(1, (MIN_RANDOM_GRID_LETTERS, letter_count),
+                                                            letter=random_letter))
 
         generated_grids = {'compact_grids': compact_grids, 'random_grids': random_grids}
 
         for grid_name in generated_grids:
 
             experiment = self.add_experiment(grid_name)
-            grid_dimension = 5
+            grid_dimension = GRID_DIMENSION
 
             for grid_index in range(0, len(generated_grids[grid_name])):
 
@@ -4,7 +4,7 @@ import logging
 
 from clemcore.backends import Model
 from clemcore.clemgame import GameMaster, GameBenchmark, GameScorer, GameSpec, metrics
-from game import ImageGame
+from game import ImageGame, compile_pattern
 from evaluator import evaluate, calculate_flipped_pixels
 
 import re
@@ -71,7 +71,7 @@ class ImageGameMaster(GameMaster):
         self.game.given_instruction.add_system_message(player_1_response_text)
 
         # check if it reached the end on 1 side
-        match = re.compile(self.game.player_1_terminate_pattern, re.IGNORECASE).match(player_1_response_text)
+        match = self.game.player_1_terminate_regex.match(player_1_response_text)
         if match:
             self.parsed_request_count += 1
             self.turn_request_stats[self.game.current_turn]['parsed_count'] += 1
@@ -80,7 +80,7 @@ class ImageGameMaster(GameMaster):
         else:
             # continue if the Player didn't say -> Instruction: DONE
             # check if Player 1 message follows the rule => start with "Instruction:"
-            player_1_message_matched = re.compile(self.game.player_1_response_pattern, re.IGNORECASE).match(player_1_response_text)
+            player_1_message_matched = self.game.player_1_response_regex.match(player_1_response_text)
             if player_1_message_matched:
                 parsed_instruction = ''
                 if '\n' in player_1_response_text:
@@ -133,7 +133,7 @@ class ImageGameMaster(GameMaster):
             self.request_count += 1
 
             # check if Player 2 message has the required format: grid
-            match = re.compile(self.game.player_2_response_pattern).match(player_2_response_text)
+            match = self.game.player_2_response_regex.match(player_2_response_text)
             if match:
                 self.parsed_request_count += 1
                 self.turn_request_stats[self.game.current_turn]['parsed_count'] += 1
@@ -165,6 +165,9 @@ class ImageGameScorer(GameScorer):
         self.player1_response_pattern = r'{}'.format(game_instance["player_1_response_pattern"])
         self.player2_response_pattern = r'{}'.format(game_instance["player_2_response_pattern"])
         self.player1_terminate_pattern = r'{}'.format(game_instance["player_1_terminate_pattern"])
+        self.player1_response_regex = compile_pattern(self.player1_response_pattern, re.IGNORECASE)
+        self.player2_response_regex = compile_pattern(self.player2_response_pattern)
+        self.player1_terminate_regex = compile_pattern(self.player1_terminate_pattern, re.IGNORECASE)
 
     def compute_scores(self, episode_interactions: Dict) -> None:
 
@@ -195,7 +198,7 @@ class ImageGameScorer(GameScorer):
             player_1_message = turn[1]['action']['content']
 
             # Player generates "DONE"
-            match = re.compile(self.player1_terminate_pattern, re.IGNORECASE).match(player_1_message)
+            match = self.player1_terminate_regex.match(player_1_message)
             if match:
                 break
 
@@ -203,7 +206,7 @@ class ImageGameScorer(GameScorer):
             episode_request_count += 1
 
             # check the Player 1 message if it matches the rule
-            player_1_message_matched = re.compile(self.player1_response_pattern, re.IGNORECASE).match(player_1_message)
+            player_1_message_matched = self.player1_response_regex.match(player_1_message)
             if player_1_message_matched:
                 if '\n' in player_1_message:
                     parsed_instruction = player_1_message.split('\n')[0]
@@ -230,7 +233,7 @@ class ImageGameScorer(GameScorer):
             episode_request_count += 1
 
             # check Player 2 message if it matches the instruction => grid
-            match = re.compile(self.player2_response_pattern).match(player_2_message)
+            match = self.player2_response_regex.match(player_2_message)
             if match:
                 turn_parsed_request_count += 1
                 episode_parsed_request_count += 1
@@ -0,0 +1,178 @@
+"""
+Random grid generation for imagegame
+
+Grids are generated as numpy boards: one uint8 per cell, 0 is an empty cell and
+1..26 are the letters A..Z. Many boards are drawn at once, the filled cells of
+every board are sampled without replacement so each board has exactly the
+requested number of letters. Boards can be constrained to a filled row, a
+filled column or a fixed pattern of cells, and a GridGenerator never returns
+the same board twice (boards are hashed), so all grids of an experiment are distinct.
+
+Example:
+generator = GridGenerator(seed=123)
+grids = generator.random_grids(1000, (5, 10), same_letter=True, fill_row=True)
+"""
+import numpy as np
+
+EMPTY_CELL = '▢'
+ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+# board code -> cell
+CELLS = np.array([EMPTY_CELL] + list(ALPHABET))
+# number of boards drawn at once is this many times the number of missing boards
+OVERSAMPLING = 2
+# give up after drawing this many batches without enough distinct boards
+MAX_ROUNDS = 100
+
+
+def letter_codes(letters):
+    """ board codes of letters ('A' -> 1, ..., 'Z' -> 26) """
+    return np.array([ALPHABET.index(letter) + 1 for letter in letters], dtype=np.uint8)
+
+
+def pattern_mask(pattern, grid_dimension):
+    """
+    Cells that a pattern fills
+    :param pattern: grid string (any letter marks a filled cell) or boolean array of shape
+                    (grid_dimension, grid_dimension)
+    :return: boolean array of shape (grid_dimension, grid_dimension)
+    """
+    if isinstance(pattern, str):
+        pattern = [[cell != EMPTY_CELL for cell in row.split()] for row in pattern.strip().split('\n')]
+    mask = np.asarray(pattern, dtype=bool)
+    assert mask.shape == (grid_dimension, grid_dimension), \
+        f"pattern of shape {mask.shape} doesn't fit a grid of dimension {grid_dimension}"
+    return mask
+
+
+def to_grid(board):
+    """
+    Render a board
+    :param board: uint8 array of shape (grid_dimension, grid_dimension)
+    :return: grid string, cells separated by spaces and rows by newlines
+    """
+    return '\n'.join(' '.join(row) for row in CELLS[board].tolist())
+
+
+def from_grid(grid):
+    """ parse a grid string into a board, see to_grid """
+    return np.array([[0 if cell == EMPTY_CELL else ALPHABET.index(cell) + 1 for cell in row.split()]
+                     for row in grid.strip().split('\n')], dtype=np.uint8)
+
+
+def to_grids(boards):
+    """ render many boards at once, see to_grid """
+    return [to_grid(board) for board in boards]
+
+
+def board_keys(boards):
+    """ one hashable key per board """
+    boards = np.ascontiguousarray(boards)
+    return [board.tobytes() for board in boards]
+
+
+class GridGenerator:
+    """
+    Draws random boards, see the module documentation. All boards returned by one
+    generator are distinct, boards that were already returned are drawn again.
+    """
+
+    def __init__(self, grid_dimension=5, seed=123):
+        self.grid_dimension = grid_dimension
+        self.rng = np.random.default_rng(seed)
+        # keys of all boards returned so far
+        self.seen = set()
+
+    def add_seen(self, grids):
+        """ exclude grids (strings or boards) from the boards still to be returned """
+        boards = [from_grid(grid) if isinstance(grid, str) else grid for grid in grids]
+        self.seen.update(board_keys(np.asarray(boards, dtype=np.uint8)))
+
+    def draw_boards(self, num_boards, number_of_letters, letter=None, same_letter=False, fill_row=False,
+                    fill_column=False, pattern=None):
+        """
+        Draw boards without checking whether they are distinct
+        :param num_boards: number of boards
+        :param number_of_letters: number of randomly placed letters, one int for all boards or one per board;
+                                  letters are only placed on cells that no constraint fills
+        :param letter: letter of all filled cells of all boards, None for random letters
+        :param same_letter: with random letters, use one random letter for all filled cells of a board
+                            (otherwise every random cell and every constraint gets a letter of its own)
+        :param fill_row: fill a random row of every board
+        :param fill_column: fill a random column of every board
+        :param pattern: fill the cells of this pattern in every board (see pattern_mask)
+        :return: uint8 array of shape (num_boards, grid_dimension, grid_dimension)
+        """
+        dimension = self.grid_dimension
+        n_cells = dimension * dimension
+        boards = np.zeros((num_boards, dimension, dimension), dtype=np.uint8)
+        if letter is not None:
+            board_letters = np.full(num_boards, letter_codes(letter)[0], dtype=np.uint8)
+        elif same_letter:
+            board_letters = self.random_letters(num_boards)
+
+        def constraint_letters():
+            if letter is None and not same_letter:
+                return self.random_letters(num_boards)
+            return board_letters
+
+        if pattern is not None:
+            boards[:, pattern_mask(pattern, dimension)] = constraint_letters()[:, None]
+        if fill_row:
+            rows = self.rng.integers(0, dimension, size=num_boards)
+            boards[np.arange(num_boards), rows, :] = constraint_letters()[:, None]
+        if fill_column:
+            columns = self.rng.integers(0, dimension, size=num_boards)
+            boards[np.arange(num_boards), :, columns] = constraint_letters()[:, None]
+
+        cells = boards.reshape(num_boards, n_cells)
+        free = cells == 0
+        counts = np.broadcast_to(np.asarray(number_of_letters), (num_boards,))
+        if (counts > free.sum(axis=1)).any():
+            raise ValueError("more letters than free cells on a board")
+        # rank the free cells of every board in random order, constrained cells come last,
+        # so the cells ranked below the count are a sample without replacement
+        keys = np.where(free, self.rng.random((num_boards, n_cells)), 2.0)
+        ranks = np.argsort(np.argsort(keys, axis=1), axis=1)
+        placed = ranks < counts[:, None]
+        if letter is None and not same_letter:
+            cells[placed] = self.random_letters(int(placed.sum()))
+        else:
+            cells[placed] = np.broadcast_to(board_letters[:, None], cells.shape)[placed]
+        return boards
+
+    def random_letters(self, size):
+        return self.rng.integers(1, len(ALPHABET) + 1, size=size, dtype=np.uint8)
+
+    def random_boards(self, num_boards, number_of_letters, **options):
+        """
+        Draw distinct boards that no earlier call returned
+        :param num_boards: number of boards
+        :param number_of_letters: number of randomly placed letters, an int or an inclusive
+                                  (min, max) tuple to draw the number for every board
+        :param options: letter, same_letter, fill_row, fill_column and pattern, see draw_boards
+        :return: uint8 array of shape (num_boards, grid_dimension, grid_dimension)
+        """
+        found = []
+        for _ in range(MAX_ROUNDS):
+            missing = num_boards - len(found)
+            if missing == 0:
+                break
+            batch = missing * OVERSAMPLING
+            if isinstance(number_of_letters, tuple):
+                counts = self.rng.integers(number_of_letters[0], number_of_letters[1] + 1, size=batch)
+            else:
+                counts = number_of_letters
+            boards = self.draw_boards(batch, counts, **options)
+            for board, key in zip(boards, board_keys(boards)):
+                if key not in self.seen:
+                    self.seen.add(key)
+                    found.append(board)
+                    if len(found) == num_boards:
+                        break
+        if len(found) < num_boards:
+            raise ValueError(f"could not draw {num_boards} distinct boards, the constraints allow too few")
+        return np.array(found, dtype=np.uint8).reshape(-1, self.grid_dimension, self.grid_dimension)
+
+    def random_grids(self, num_grids, number_of_letters, **options):
+        """ random_boards rendered as grid strings """
+        return to_grids(self.random_boards(num_grids, number_of_letters, **options))
@@ -0,0 +1,303 @@
+"""
+Plots and animations of the paths walked in the map games (mm_mapworld
+variants and mm_mapworld_qa).
+
+Scoring stores a visualization job (see visualization_job) in every episode
+directory; the figures are drawn afterwards, in parallel, by running
+
+    python3 games/map_visualizations.py results [--workers N]
+
+Storing jobs only needs the standard library and numpy, matplotlib and
+imageio are imported once something is drawn. Import it like the other
+shared modules (sys.path.append(os.path.abspath('../clemgames')), then
+import map_visualizations) or, in the old framework, as games.map_visualizations.
+"""
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+def new_figure(**kwargs):
+    """ creates a figure that is drawn on its own Agg canvas, 
+        independent of pyplot and its global state """
+    # plotting is only imported when something is drawn, storing jobs needs none of it
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def figure_to_frame(fig):
+    """ renders a figure and returns its pixels as an RGB 
+        uint8 array, without going through an image file """
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())[..., :3].copy()
+
+
+class PathPlot:
+    """Plot of the target map and the path walked on it. The node and
+    edge artists are created once; every step of the path only recolors
+    them and adds one arrow, so animation frames can be rendered from 
+    the same figure.
+
+    Args:
+        ax: the axes to draw on
+        nodes (list): the nodes of the map
+        edges (list): the edges of the map
+        start (tuple): the starting node
+        markersize (float): size of the node markers
+        edge_width (float): line width of the edges
+        highlight_edges (bool): draw the edges between visited nodes in black
+        target (tuple): node highlighted once it has been visited (mm_mapworld_specificroom)
+    """
+    offset = 0.05
+
+    def __init__(self, ax, nodes, edges, start, markersize = 25, edge_width = None,
+                 highlight_edges = True, target = None):
+        self.ax = ax
+        self.target = target
+        self.highlight_edges = highlight_edges
+        self.path = []
+        self.nodes_in_path = set()
+        self.traveled = {node: 0 for node in nodes}
+        self.traveled[start] += 1
+        self.last = None
+        self.last_arrow = None
+        self.node_artists = {}
+        for node in nodes:
+            self.node_artists[node] = ax.plot(node[0], node[1], 'o', color='brown', 
+                        linewidth = 20, markersize = markersize, zorder = 9, mfc = 'tab:gray')[0]
+        self.edge_artists = {}
+        for edge in edges:
+            artist = ax.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='gray', 
+                             linestyle='--', zorder = 5, linewidth = edge_width)[0]
+            for node in edge:
+                self.edge_artists.setdefault(node, []).append((edge, artist))
+
+    def color_node(self, node, color):
+        if node == self.target:
+            color = 'tab:orange'
+        self.node_artists[node].set_markerfacecolor(color)
+
+    def step(self, node):
+        """ adds the next node of the path to the plot """
+        if self.last_arrow is not None:
+            self.last_arrow.set_color("black")
+            self.last_arrow = None
+        if self.path:
+            self.color_node(self.path[-1], 'tab:olive')
+        self.color_node(node, 'tab:cyan')
+        if node not in self.nodes_in_path:
+            self.nodes_in_path.add(node)
+            if self.highlight_edges:
+                for edge, artist in self.edge_artists.get(node, []):
+                    if edge[0] in self.nodes_in_path and edge[1] in self.nodes_in_path:
+                        artist.set_color('black')
+        if not self.path:
+            self.last = node
+        elif node != self.path[-1]:
+            x1, y1 = self.last
+            dx = node[0] - x1
+            dy = node[1] - y1
+            t = self.traveled[node]
+            self.traveled[node] += 1
+            t = sum([(1/(1+j)) for j in range(t)])
+            self.last_arrow = self.ax.arrow(x1, 
+                                            y1, 
+                                            dx + t * self.offset, 
+                                            dy + t * self.offset, 
+                                            color="red", 
+                                            width = 0.005, 
+                                            head_width = 0.05, 
+                                            length_includes_head = True, 
+                                            zorder = 10)
+            self.last = (
+                x1 + dx + t * self.offset,
+                y1 + dy + t * self.offset
+            )
+        self.path.append(node)
+
+
+def animation_writer(path, fps = 1):
+    """ opens a looping gif that frames (RGB arrays) can be appended to """
+    import imageio
+    return imageio.get_writer(path, mode = "I", fps = fps, loop = 0)
+
+
+def save_animation(path, frames, fps = 1):
+    """ streams the frames (RGB arrays) into a looping gif """
+    with animation_writer(path, fps) as writer:
+        for frame in frames:
+            writer.append_data(frame)
+
+
+########## Visualizations of scored episodes
+
+VISUALIZATION_JOB = "visualization_job.json"
+
+
+def path_figure(job):
+    """ creates the path figure of an episode, without any step of the path """
+    fig = new_figure(figsize=(4, 4))
+    ax = fig.add_subplot()
+    path_plot = PathPlot(ax, job["nodes"], job["edges"], job["start"], 
+                         highlight_edges = job["highlight_edges"], target = job["target"])
+    ax.set_xlim(-1, 4)
+    ax.set_ylim(-1, 4)
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.grid(True, alpha = job["grid_alpha"])
+    return fig, path_plot
+
+
+def path_and_gen_figure(job):
+    """ creates the figure with the target graph on the left and an
+        empty plot for the generated graph on the right """
+    fig = new_figure(figsize = (8,4))
+    ax1, ax2 = fig.subplots(1,2, sharex = True, sharey = True)
+    path_plot = PathPlot(ax1, job["nodes"], job["edges"], job["start"], 
+                         markersize = 17.5, edge_width = 1.8)
+    ax2.set_xlim(-3, 6)
+    ax2.set_ylim(-3, 6)
+    ax1.set_xlabel('X')
+    ax2.set_xlabel('X')
+    ax1.set_ylabel('Y')
+    ax1.grid(True)
+    ax2.grid(True)
+    tcks = np.arange(-2, 7)
+    ax1.set_xticks(tcks)
+    ax2.set_xticks(tcks)
+    ax1.set_yticks(tcks)
+    ax2.set_yticks(tcks)
+    ax1.set_title("Target Graph")
+    ax2.set_title("Generated Graph")
+    return fig, path_plot, ax2
+
+
+def plot_gen(ax, graph):
+    """ draws a generated graph and returns its artists """
+    artists = []
+    for node in graph['V']:
+        artists += ax.plot(node[0], node[1], 'o', color='brown', 
+                linewidth = 10, markersize = 17.5, zorder = 9, mfc = 'tab:gray')
+    for edge in graph['E']:
+        artists += ax.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='gray', 
+                 linestyle='--', zorder = 5, linewidth = 1.8)
+    return artists
+
+
+def iter_path_frames(job):
+    """ yields one frame per step of the path, drawn on the same figure """
+    fig, path_plot = path_figure(job)
+    for node in job["path"]:
+        path_plot.step(node)
+        yield figure_to_frame(fig)
+
+
+def iter_path_and_gen(job):
+    """ yields (turn, figure) for every generated graph, next to the path walked 
+        up to that turn; the same figure is updated in place for every turn """
+    fig, path_plot, ax2 = path_and_gen_figure(job)
+    gen_artists = []
+    for i, graph in enumerate(job["gens"]):
+        if i < len(job["path"]):
+            path_plot.step(job["path"][i])
+        for artist in gen_artists:
+            artist.remove()
+        gen_artists = plot_gen(ax2, graph)
+        yield i, fig
+
+
+def visualization_job(nodes, edges, start, path, target = None, gens = None, 
+                      highlight_edges = True, grid_alpha = None,
+                      store_animations = True, store_pdfs = True):
+    """ everything needed to draw the visualizations of an episode,
+        in a form that can be stored as json """
+    return {
+        "nodes": nodes,
+        "edges": edges,
+        "start": start,
+        "path": path,
+        "target": target,
+        "gens": gens,
+        "highlight_edges": highlight_edges,
+        "grid_alpha": grid_alpha,
+        "store_animations": store_animations,
+        "store_pdfs": store_pdfs
+    }
+
+
+def load_job(job):
+    """ reverts the json serialization of a visualization job (lists back to tuples) """
+    loaded = dict(job)
+    loaded["nodes"] = [tuple(node) for node in job["nodes"]]
+    loaded["edges"] = [(tuple(edge[0]), tuple(edge[1])) for edge in job["edges"]]
+    loaded["start"] = tuple(job["start"])
+    loaded["path"] = [tuple(node) for node in job["path"]]
+    if job["target"] is not None:
+        loaded["target"] = tuple(job["target"])
+    return loaded
+
+
+def render_visualizations(job, episode_dir):
+    """ draws path.png, the path animation and, if the job has generated
+        graphs, their pdfs and animation into the episode directory """
+    job = load_job(job)
+    fig, path_plot = path_figure(job)
+    for node in job["path"]:
+        path_plot.step(node)
+    fig.savefig(os.path.join(episode_dir, "path.png"))
+    if job["gens"] and (job["store_animations"] or job["store_pdfs"]):
+        gen_dir = os.path.join(episode_dir, "generated_graphs")
+        os.makedirs(gen_dir, exist_ok=True)
+        writer = animation_writer(os.path.join(gen_dir, "animation.gif")) if job["store_animations"] else None
+        for i, fig in iter_path_and_gen(job):
+            if job["store_pdfs"]:
+                fig.savefig(os.path.join(gen_dir, f"{i}.pdf"))
+            if writer is not None:
+                writer.append_data(figure_to_frame(fig))
+        if writer is not None:
+            writer.close()
+    if job["store_animations"]:
+        save_animation(os.path.join(episode_dir, "animation.gif"), iter_path_frames(job))
+
+
+def store_visualizations(job, episode_dir, defer = True):
+    """ either renders the visualizations of an episode right away or 
+        leaves the job in the episode directory for render_pending_visualizations """
+    if defer:
+        with open(os.path.join(episode_dir, VISUALIZATION_JOB), "w") as f:
+            json.dump(job, f)
+    else:
+        render_visualizations(job, episode_dir)
+
+
+def render_job_file(job_path):
+    with open(job_path) as f:
+        job = json.load(f)
+    render_visualizations(job, os.path.dirname(job_path))
+    os.remove(job_path)
+    return job_path
+
+
+def render_pending_visualizations(results_root, workers = None):
+    """ renders all visualization jobs left under results_root in a process pool;
+        a job file is removed once its episode has been rendered """
+    job_paths = []
+    for dirpath, _, filenames in os.walk(results_root):
+        if VISUALIZATION_JOB in filenames:
+            job_paths.append(os.path.join(dirpath, VISUALIZATION_JOB))
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        return list(executor.map(render_job_file, job_paths))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "Render the deferred mm_mapworld (and mm_mapworld_qa) visualizations of a results directory.")
+    parser.add_argument("results_root")
+    parser.add_argument("--workers", type = int, default = None)
+    args = parser.parse_args()
+    rendered = render_pending_visualizations(args.results_root, args.workers)
+    print(f"rendered {len(rendered)} episodes")
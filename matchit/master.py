@@ -6,8 +6,12 @@ from clemcore.utils import file_utils
 from typing import List, Dict, Tuple
 import numpy as np
 import os
+import sys
 import logging
 
+sys.path.append(os.path.abspath('../clemgames'))
+import image_cache
+
 logger = logging.getLogger(__name__)
 
 class MatchItPlayer(Player):
@@ -23,6 +27,10 @@ class MatchItPlayer(Player):
 
         self.had_success: bool = False
 
+    def __call__(self, messages, turn_idx):
+        # the history keeps the original images, the model gets the prepared copies
+        return super().__call__(image_cache.prepare_messages(messages, self.model), turn_idx)
+
     def _custom_response(self, messages, turn_idx) -> str:
         last_message = messages[-1]["content"]
 
@@ -2,13 +2,15 @@ from clemcore.clemgame import GameInstanceGenerator
 import sys
 import os
 sys.path.append(os.path.abspath('../clemgames/mm_mapworld'))
+sys.path.append(os.path.abspath('../clemgames'))
 from mm_mapworld_maps import AbstractMap
+import mm_mapworld_utils as utils
+import image_store
 
 import numpy as np
 import os
 import random
 import json
-import shutil
 
 
 # set the name of the game in the script, as you named the directory
@@ -22,7 +24,6 @@ RANDOM_PATH = "random_test_images"
 IMAGE_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "images")
 DATASET_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "ade_20k_reduced", "ade_imgs")
 MAPPING_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "ade_20k_reduced", "captions.json")
-TEMP_IMAGE_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "images")
 MOVE_CONSTRUCTION = "GO: "
 STOP_CONSTRUCTION = "DONE"
 GRAPH_REGEX = "\"graph\":\s*(\{\s*\"nodes\"\s*:\s*\[.*\]\s*,\s*\"edges\"\s*:\s*\{.*\})\s*\}$"
@@ -37,41 +38,30 @@ def create_instances(grid_size, graph_size, num_instances = NUM_INSTANCES):
     instances = []
     np.random.seed(SEED)
     random.seed(SEED)
+    rng = np.random.default_rng(SEED)
+    categories = utils.load_category_index(MAPPING_PATH)
     for i in range(num_instances):
         map = AbstractMap(*grid_size, graph_size)   
-        nodes = [str(n) for n in map.G]
+        nodes = list(map.G)
         edges = list(map.G.edges())
         rev_edges = [(edge[1], edge[0]) for edge in edges]
         edges.extend(rev_edges)
-        img_ref, cat_ref = assign_images(nodes)
+        img_ref, cat_ref = assign_images(nodes, categories, rng)
         instances.append({
-            'nodes': nodes,
-            'edges': [str(e) for e in edges],
-            'imgs': img_ref,
-            'cats': cat_ref,
-            'start': random.choice(nodes),
+            **utils.encode_instance(nodes, edges, img_ref, cat_ref, random.choice(nodes)),
             'use_loop_warning': True,
             'use_turn_limit_warning': True
         })
     return instances
 
-def assign_images(nodes):
-    with open(MAPPING_PATH, 'r', encoding='utf-8') as f:
-        mapping = json.load(f)
-    cats = mapping.keys()
-    cats_inside = [cat for cat in cats if 'outdoor' not in cat]
-    chosen_cats = np.random.choice(cats_inside, size=len(nodes))
+def assign_images(nodes, categories, rng):
+    # the keys of the captions are the images themselves, no image is used twice on a map
+    chosen_imgs = categories.sample_inside(rng, size=len(nodes), replace=False)
     imgs = {}
     cat_mapping = {}
-    for i in range(len(nodes)):
-        if nodes[i] in cat_mapping:
-            cat_mapping[nodes[i]].append(chosen_cats[i])
-        else:
-            cat_mapping[nodes[i]] = [chosen_cats[i]]
-
-        node_img = np.random.choice(cat_mapping[nodes[i]])
-        after_copy_path = copy_image(os.path.join(DATASET_PATH, node_img))
-        imgs[nodes[i]] = after_copy_path
+    for node, node_img in zip(nodes, chosen_imgs):
+        cat_mapping[node] = [node_img]
+        imgs[node] = copy_image(os.path.join(DATASET_PATH, node_img))
     return imgs, cat_mapping
 
 def instance_from_args(args, prompts):
@@ -104,17 +94,9 @@ def instances_from_instances(instances, prompts):
         instances[i]["loop_warning"] = prompts["loop_warning"]
     return instances
 
-def prep_image_dir():
-    if os.path.exists(TEMP_IMAGE_PATH):
-        shutil.rmtree(TEMP_IMAGE_PATH)
-    os.makedirs(TEMP_IMAGE_PATH)
-    
 def copy_image(image_path):
-    filename = os.path.split(image_path)[1]
-    src = image_path
-    tgt = os.path.join(TEMP_IMAGE_PATH, filename)
-    shutil.copy(src, tgt)
-    return tgt
+    """ adds the image to the shared image store instead of copying it into the resources of the game """
+    return image_store.add_image(image_path)
         
 
 class MmMapWorldGraphsInstanceGenerator(GameInstanceGenerator):
@@ -137,14 +119,13 @@ class MmMapWorldGraphsInstanceGenerator(GameInstanceGenerator):
             'large': {"size": "large", "reprompt": False, "one_shot": True}
         }
 
-        prep_image_dir()
         base_instance_path = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_graphs", "in", "instances.json")
         
         if os.path.exists(base_instance_path):
             with open(base_instance_path, 'r') as f:
                 base_instances = json.load(f)
-            images_path = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "images")
-            assert os.path.exists(images_path), "run instancegenerator for mm_mapworld to create images directory."
+            images = [img for exp in base_instances["experiments"] for inst in exp["game_instances"] for img in utils.instance_images(inst)]
+            assert all(os.path.exists(image_store.resolve_image(img)) for img in images), "run instancegenerator for mm_mapworld to create the images."
             new_instances = {"experiments": base_instances["experiments"][:3]}
             for i in range(len(new_instances["experiments"])):
                 new_instances["experiments"][i]["game_instances"] = instances_from_instances(new_instances["experiments"][i]["game_instances"], prompts)
@@ -153,8 +134,6 @@ class MmMapWorldGraphsInstanceGenerator(GameInstanceGenerator):
             new_instance_path = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_graphs", "in", "instances.json")
             with open(new_instance_path, "w", encoding='utf-8') as f:
                 json.dump(new_instances, f)
-            if os.path.exists(TEMP_IMAGE_PATH):
-                shutil.rmtree(TEMP_IMAGE_PATH)
             exit(1)
         
         else:
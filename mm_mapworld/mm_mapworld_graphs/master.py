@@ -7,13 +7,14 @@ from queue import Queue
 from copy import deepcopy
 import numpy as np
 import matplotlib.pyplot as plt
-import imageio
-import shutil
 import networkx as nx
 
 import sys
 sys.path.append(os.path.abspath('../clemgames/mm_mapworld'))
+sys.path.append(os.path.abspath('../clemgames'))
 import mm_mapworld_utils as utils
+import image_cache
+import map_visualizations
 from clemcore.backends import Model, CustomResponseModel
 from clemcore.clemgame import GameMaster, GameBenchmark, DialogueGameMaster, GameScorer, GameSpec
 from clemcore.clemgame import Player
@@ -24,6 +25,11 @@ from clemcore.clemgame.metrics import METRIC_ABORTED, METRIC_SUCCESS, METRIC_LOS
 DIRS = ["north", "south", "east", "west"]
 GAME_NAME = 'mm_mapworld_graphs'
 MAX_TURNS = 20
+# visualizations written by the scorer next to scores.json
+STORE_ANIMATIONS = True
+STORE_PDFS = True
+# leave the visualizations as a job in the episode directory instead of drawing them while scoring
+DEFER_VISUALIZATIONS = True
 
 CARDINAL_TO_DELTA = {
     'north': (0, 1),
@@ -50,6 +56,10 @@ class PathWalker(Player):
     def __init__(self, model: Model):
         super().__init__(model)
 
+    def __call__(self, messages, turn_idx):
+        # the history keeps the original images, the model gets the prepared copies
+        return super().__call__(image_cache.prepare_messages(messages, self.model), turn_idx)
+
     def _custom_response(self, messages, turn_idx) -> str:
         """Return a random direction."""
         random_dir = random.choice(DIRS)
@@ -57,12 +67,13 @@ class PathWalker(Player):
     
 
 class PathDescriber(Player):
-    def __init__(self, model, game_instance):
+    def __init__(self, model, game_instance, instance_key = None):
         super().__init__(model)
-        instance_data = utils.load_instance(game_instance)
+        instance_data = utils.load_instance(game_instance, instance_key)
         self.imgs = instance_data["imgs"]
         self.nodes = instance_data["nodes"]
         self.edges = instance_data["edges"]
+        self.adjacency = instance_data["adjacency"]
         self.start = instance_data["start"]
         self.current_room = instance_data["start"]
         self.success_response = game_instance["success_response"]
@@ -78,7 +89,7 @@ class PathDescriber(Player):
 
         
     def get_available_moves(self, node):
-        return [edge for edge in self.edges if node == edge[0]]
+        return [(node, neighbor) for neighbor in self.adjacency[node].values()]
     
     def detect_loop(self):
         if len(self.visited_nodes) >= 4:
@@ -87,15 +98,11 @@ class PathDescriber(Player):
         return False
     
     def get_available_directions(self, node):
-        moves = self.get_available_moves(node)
-        deltas = [utils.edge_to_delta(move) for move in moves]
-        cardinals = [DELTA_TO_CARDINAL[delta] for delta in deltas]
-        return cardinals
+        return list(self.adjacency[node])
     
     def cardinal_room_change(self, cardinal):
-        delta = CARDINAL_TO_DELTA[cardinal]
-        new_room = (self.current_room[0] + delta[0], self.current_room[1] + delta[1])
-        if (self.current_room, new_room) in self.edges:
+        new_room = self.adjacency[self.current_room].get(cardinal)
+        if new_room is not None:
             self.current_room = new_room
 
     def _custom_response(self, messages, turn_idx) -> str:
@@ -126,29 +133,30 @@ class MmMapWorldGraphs(DialogueGameMaster):
         self.need_reprompt: bool = False
         self.did_reprompt: bool = False
         self.experiment = experiment['name']
+        # player -> indices of the messages in its history that carry images
+        self.image_messages = {}
+        self.game_name = game_name
         
     def get_available_moves(self, node):
-        return [edge for edge in self.edges if node == edge[0]]
+        return [(node, neighbor) for neighbor in self.adjacency[node].values()]
     
     def get_available_directions(self, node):
-        moves = self.get_available_moves(node)
-        deltas = [utils.edge_to_delta(move) for move in moves]
-        cardinals = [DELTA_TO_CARDINAL[delta] for delta in deltas]
-        return cardinals
+        return list(self.adjacency[node])
     
     def cardinal_room_change(self, cardinal):
-        delta = CARDINAL_TO_DELTA[cardinal]
-        new_room = (self.current_room[0] + delta[0], self.current_room[1] + delta[1])
-        if (self.current_room, new_room) in self.edges:
+        new_room = self.adjacency[self.current_room].get(cardinal)
+        if new_room is not None:
             self.current_room = new_room
                        
     def _on_setup(self, **game_instance):
         """" sets the information you specify in instances.json """
         self.game_instance = game_instance
-        instance_data = utils.load_instance(self.game_instance)
+        self.instance_key = utils.instance_key(self.game_name, self.experiment, game_instance)
+        instance_data = utils.load_instance(self.game_instance, self.instance_key)
         self.imgs = instance_data["imgs"]
         self.nodes = instance_data["nodes"]
         self.edges = instance_data["edges"]
+        self.adjacency = instance_data["adjacency"]
         self.start = instance_data["start"]        
         self.cats = instance_data["cats"]
         self.current_room = instance_data["start"]
@@ -166,7 +174,7 @@ class MmMapWorldGraphs(DialogueGameMaster):
         self.do_reprompt = game_instance["reprompt"]
         self.reprompt_format = game_instance["reprompt_format"]
 
-        self.describer = PathDescriber(CustomResponseModel(), game_instance)
+        self.describer = PathDescriber(CustomResponseModel(), game_instance, self.instance_key)
         self.walker = PathWalker(self.player_models[0])
         self.add_player(self.describer)
         self.add_player(self.walker)
@@ -296,17 +304,23 @@ class MmMapWorldGraphs(DialogueGameMaster):
     ########## Multimodal specific functions:
     
     def remove_previous_images(self, player: Player):
+        """ removes the images from all but the last message of the history,
+            only the messages known to carry images are visited """
         history = self.messages_by_names[player.descriptor]
-        for i in range(len(history)-1):
-            if "image" in history[i]:
-                del history[i]['image']
+        with_images = self.image_messages.setdefault(player.descriptor, [])
+        last = len(history) - 1
+        for i in with_images:
+            if i < last:
+                history[i].pop('image', None)
+        with_images[:] = [i for i in with_images if i >= last]
 
     def add_message(self, player: Player, utterance: str, role: str, image = None):
+        history = self.messages_by_names[player.descriptor]
         if image is None:
             message = {"role": role, "content": utterance}
         else:
             message = {"role": role, "content": utterance, "image": image}
-        history = self.messages_by_names[player.descriptor]
+            self.image_messages.setdefault(player.descriptor, []).append(len(history))
         history.append(message)
 
     def add_user_message(self, player: Player, utterance: str, image = None):
@@ -319,11 +333,13 @@ class MmMapWorldGraphs(DialogueGameMaster):
 class MM_MapWorldGraphsScorer(GameScorer):
     def __init__(self, game_name: str, experiment: Dict, game_instance: Dict):
         super().__init__(game_name, experiment, game_instance)
-        instance_data = utils.load_instance(self.game_instance)
+        instance_key = utils.instance_key(game_name, experiment['name'], game_instance)
+        instance_data = utils.load_instance(self.game_instance, instance_key)
         self.name = game_name
         self.imgs = instance_data["imgs"]
         self.nodes = instance_data["nodes"]
         self.edges = instance_data["edges"]
+        self.adjacency = instance_data["adjacency"]
         self.start_node = instance_data["start"]
         self.response_regex = re.compile(game_instance['response_regex'], re.IGNORECASE)
         self.actual_graph = nx.Graph()
@@ -332,18 +348,21 @@ class MM_MapWorldGraphsScorer(GameScorer):
         self.graph_repr = nx.Graph()
         self.vertex_to_coor = {}
         self.gen_start = None
+        self.store_animations = STORE_ANIMATIONS
+        self.store_pdfs = STORE_PDFS
+        self.defer_visualizations = DEFER_VISUALIZATIONS
         
     def adj(self, node):
-        return set([ed[1] for ed in self.edges if ed[0] == node])
+        return set(self.adjacency[node].values())
     
     def visited_all(self, visited, to_visit):
         return all([n in visited for n in to_visit])
     
     def get_available_moves(self, node, visited):
-        return [edge for edge in self.edges if node == edge[0] and (edge[0] in visited or edge[1] in visited)]
+        return [(node, neighbor) for neighbor in self.adjacency[node].values() if node in visited or neighbor in visited]
     
     def find_best_moves(self, current, visited):
-        to_visit = [ed[1] for ed in self.edges if ed[0] in visited and ed[1] not in visited]
+        to_visit = [neighbor for node in visited for neighbor in self.adjacency[node].values() if neighbor not in visited]
         start = [current]
         q = Queue()
         q.put(start)
@@ -436,137 +455,6 @@ class MM_MapWorldGraphsScorer(GameScorer):
         plt.grid(True)
         return fig
     
-    def plot_path_and_gen(self, path, graph):
-        offset = 0.05
-        fig, (ax1, ax2) = plt.subplots(1,2, figsize = (8,4), sharex = True, sharey = True)
-        plt.xlim(-3, 6)
-        plt.ylim(-3, 6)
-        # path plot on the left (ax1)
-        for node in self.nodes:
-            if node in path and node != path[-1]:
-                ax1.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 17.5, zorder = 9, mfc = 'tab:olive')
-            if node == path[-1]:
-                ax1.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 17.5, zorder = 9, mfc = 'tab:cyan')
-            if not node in path:
-                ax1.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 17.5, zorder = 9, mfc = 'tab:gray')    
-        traveled = {node: 0 for node in self.nodes}
-        traveled[self.start_node] += 1
-        for edge in self.edges:
-            if edge[0] in path and edge[1] in path:
-                ax1.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='black', 
-                         linestyle='--', zorder = 5, linewidth = 1.8)
-            else:
-                ax1.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='gray', 
-                         linestyle='--', zorder = 5, linewidth = 1.8)
-        last = path[0]
-        if len(path) > 1:
-            for i in range(1, len(path)):
-                if path[i] == path[i - 1]:
-                    continue
-                x1, y1 = last
-                x2, y2 = path[i]
-                dx = x2 - x1
-                dy = y2 - y1
-                t = traveled[path[i]]
-                traveled[path[i]] += 1
-                color = "black"
-                if i == len(path)-1:
-                    color = "red"
-                t = sum([(1/(1+j)) for j in range(t)])
-                ax1.arrow(x1, 
-                        y1, 
-                        dx + t * offset, 
-                        dy + t * offset, 
-                        color=color, 
-                        width = 0.005, 
-                        head_width = 0.05, 
-                        length_includes_head = True, 
-                        zorder = 10)
-                last = (
-                    x1 + dx + t * offset,
-                    y1 + dy + t * offset
-                )   
-        # the generated graph goes on the right (ax2)
-        nodes = graph['V']
-        edges = graph['E']
-        for node in nodes:
-            ax2.plot(node[0], node[1], 'o', color='brown', 
-                    linewidth = 10, markersize = 17.5, zorder = 9, mfc = 'tab:gray')
-        for edge in edges:
-            ax2.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='gray', 
-                     linestyle='--', zorder = 5, linewidth = 1.8)
-        ax1.set_xlabel('X')
-        ax2.set_xlabel('X')
-        ax1.set_ylabel('Y')
-        ax1.grid(True)
-        ax2.grid(True)
-        tcks = np.arange(-2, 7)
-        ax1.set_xticks(tcks)
-        ax2.set_xticks(tcks)
-        ax1.set_yticks(tcks)
-        ax2.set_yticks(tcks)
-        ax1.set_title("Target Graph")
-        ax2.set_title("Generated Graph")
-        return fig
-                
-    def plot_path(self, path):
-        offset = 0.05
-        fig = plt.figure(figsize=(4, 4))
-        for node in self.nodes:
-            if node in path and node != path[-1]:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:olive')
-            if node == path[-1]:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:cyan')
-            if not node in path:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:gray')
-        plt.xlim(-1, 4)
-        plt.ylim(-1, 4)
-        traveled = {node: 0 for node in self.nodes}
-        traveled[self.start_node] += 1
-        for edge in self.edges:
-            if edge[0] in path and edge[1] in path:
-                plt.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='black', linestyle='--', zorder = 5)
-            else:
-                plt.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='gray', linestyle='--', zorder = 5)
-        last = path[0]
-        if len(path) > 1:
-            for i in range(1, len(path)):
-                if path[i] == path[i - 1]:
-                    continue
-                x1, y1 = last
-                x2, y2 = path[i]
-                dx = x2 - x1
-                dy = y2 - y1
-                t = traveled[path[i]]
-                traveled[path[i]] += 1
-                color = "black"
-                if i == len(path)-1:
-                    color = "red"
-                t = sum([(1/(1+j)) for j in range(t)])
-                plt.arrow(x1, 
-                        y1, 
-                        dx + t * offset, 
-                        dy + t * offset, 
-                        color=color, 
-                        width = 0.005, 
-                        head_width = 0.05, 
-                        length_includes_head = True, 
-                        zorder = 10)
-                last = (
-                    x1 + dx + t * offset,
-                    y1 + dy + t * offset
-                )
-        plt.xlabel('X')
-        plt.ylabel('Y')
-        plt.grid(True)
-        return fig
-    
     def normalize(self, distance):
         normalized_distance = 1 / (1 + np.exp(-0.5 * distance))
         normalized_distance = 2*(normalized_distance - 0.5)
@@ -690,40 +578,13 @@ class MM_MapWorldGraphsScorer(GameScorer):
                                 dialogue_pair=dialogue_pair,
                                 sub_dir=game_record_dir,
                                 root_dir=results_root)
-        # plotting & animation
-        if not os.path.exists("tmp"):
-            os.makedirs("tmp")
-        path_plot = self.plot_path(self.path)
-        path_plot.savefig(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "path.png"))
-        plt.close()
-        if not os.path.exists("tmp/step_plots"):
-            os.makedirs("tmp/step_plots")
-        images = []
-        gen_images = []
-        gen_dir = os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "generated_graphs")
-        tmp_gen_dir = os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "generated_graphs", "tmp")
-        if not os.path.exists(tmp_gen_dir):
-            os.makedirs(tmp_gen_dir)
-        for i in range(len(self.gens)):
-            generated_graph_turn = self.plot_path_and_gen(self.path[:i+1], self.gens[i])
-            generated_graph_turn.savefig(os.path.join(tmp_gen_dir, f"{i}.png"))
-            generated_graph_turn.savefig(os.path.join(gen_dir, f"{i}.pdf"))
-            gen_images.append(imageio.imread(os.path.join(tmp_gen_dir, f"{i}.png")))
-            plt.close()
-        if self.gens:
-            imageio.mimsave(os.path.join(gen_dir, "animation.gif"), gen_images, fps=1, loop=True)
-        for i in range(len(self.path)):
-            step_plot = self.plot_path(self.path[:i+1])
-            step_plot.savefig(f"tmp/step_plots/{i}.png")
-            images.append(imageio.imread(f"tmp/step_plots/{i}.png"))
-            plt.close()
-        imageio.mimsave(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "animation.gif"), images, fps=1, loop=True)
-        try:
-            shutil.rmtree("tmp")
-            shutil.rmtree(tmp_gen_dir)
-        except OSError as e:
-            print("Error: %s - %s." % (e.filename, e.strerror))
-        
+        # plotting & animation, see map_visualizations.render_pending_visualizations
+        episode_dir = os.path.join(results_root, dialogue_pair, self.name, game_record_dir)
+        job = map_visualizations.visualization_job(self.nodes, self.edges, self.start_node, self.path,
+                                                   gens = self.gens,
+                                                   store_animations = self.store_animations,
+                                                   store_pdfs = self.store_pdfs)
+        map_visualizations.store_visualizations(job, episode_dir, defer = self.defer_visualizations)
         
                 
 
@@ -2,14 +2,15 @@ from clemcore.clemgame import GameInstanceGenerator
 import sys
 import os
 sys.path.append(os.path.abspath('../clemgames/mm_mapworld'))
+sys.path.append(os.path.abspath('../clemgames'))
 from mm_mapworld_maps import AbstractMap
+import mm_mapworld_utils as utils
+import image_store
 
 import numpy as np
 import networkx as nx
 import os
 import random
-import json
-import shutil
 
 
 # set the name of the game in the script, as you named the directory
@@ -28,7 +29,6 @@ if CAPTIONS:
 else:
     DATASET_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "ade_20k_reduced", "ade_imgs")
     MAPPING_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "ade_20k_reduced", "cats.json")
-TEMP_IMAGE_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "images")
 MOVE_CONSTRUCTION = "GO: "
 STOP_CONSTRUCTION = "DONE"
 RESPONSE_REGEX = "^\{[\s]*\"description\":\s*\"([^\{]*?)\"\s*,\s*\"action\":\s*\"([^\{]*?)\"[\s]*\}$"
@@ -41,6 +41,8 @@ def create_instances(grid_size = GRIDS['medium'], graph_size = SIZES['medium'],
     instances = []
     np.random.seed(SEED)
     random.seed(SEED)
+    rng = np.random.default_rng(SEED)
+    categories = utils.load_category_index(MAPPING_PATH)
     for i in range(num_instances):
         j = 0
         while j < 10000:
@@ -59,17 +61,13 @@ def create_instances(grid_size = GRIDS['medium'], graph_size = SIZES['medium'],
                     break
         if j == 1000:   
             print("could not find an appropriate graph with cycles = ", cycle)     
-        nodes = [str(n) for n in map.G]
+        nodes = list(map.G)
         edges = list(map.G.edges())
         rev_edges = [(edge[1], edge[0]) for edge in edges]
         edges.extend(rev_edges)
-        img_ref, cat_ref = assign_images(nodes)
+        img_ref, cat_ref = assign_images(nodes, categories, rng)
         instances.append({
-            'nodes': nodes,
-            'edges': [str(e) for e in edges],
-            'imgs': img_ref,
-            'cats': cat_ref,
-            'start': random.choice(nodes),
+            **utils.encode_instance(nodes, edges, img_ref, cat_ref, random.choice(nodes)),
             'use_images': True,
             'reprompt': False,
             'use_loop_warning': True,
@@ -77,29 +75,21 @@ def create_instances(grid_size = GRIDS['medium'], graph_size = SIZES['medium'],
         })
     return instances
 
-def assign_images(nodes):
-    with open(MAPPING_PATH, 'r', encoding='utf-8') as f:
-        mapping = json.load(f)
-    cats = mapping.keys()
-    cats_inside = [cat for cat in cats if 'outdoor' not in cat]
-    chosen_cats = np.random.choice(cats_inside, size=len(nodes))
+def assign_images(nodes, categories, rng):
     imgs = {}
     cat_mapping = {}
-    for i in range(len(nodes)):
-        if CAPTIONS:
-            if nodes[i] in cat_mapping:
-                cat_mapping[nodes[i]].append(chosen_cats[i])
-            else:
-                cat_mapping[nodes[i]] = [chosen_cats[i]]
-
-            node_img = np.random.choice(cat_mapping[nodes[i]])
-            after_copy_path = copy_image(os.path.join(DATASET_PATH, node_img))
-            imgs[nodes[i]] = after_copy_path
-        else:
-            node_img = np.random.choice(mapping[chosen_cats[i]])
-            cat_mapping[nodes[i]] = chosen_cats[i]
-            after_copy_path = copy_image(os.path.join(DATASET_PATH, chosen_cats[i], node_img))
-            imgs[nodes[i]] = after_copy_path
+    if CAPTIONS:
+        # the keys of the captions are the images themselves, no image is used twice on a map
+        chosen_imgs = categories.sample_inside(rng, size=len(nodes), replace=False)
+        for node, node_img in zip(nodes, chosen_imgs):
+            cat_mapping[node] = [node_img]
+            imgs[node] = copy_image(os.path.join(DATASET_PATH, node_img))
+    else:
+        chosen_cats = categories.sample_inside(rng, size=len(nodes))
+        for node, node_cat in zip(nodes, chosen_cats):
+            node_img = categories.sample_images(rng, node_cat)
+            cat_mapping[node] = node_cat
+            imgs[node] = copy_image(os.path.join(DATASET_PATH, node_cat, node_img))
     return imgs, cat_mapping
 
 def instance_from_args(args, prompts):
@@ -123,17 +113,9 @@ def instance_from_args(args, prompts):
         instances[i]["loop_warning"] = prompts["loop_warning"]
     return instances
         
-def prep_image_dir():
-    if os.path.exists(TEMP_IMAGE_PATH):
-        shutil.rmtree(TEMP_IMAGE_PATH)
-    os.makedirs(TEMP_IMAGE_PATH)
-    
 def copy_image(image_path):
-    filename = os.path.split(image_path)[1]
-    src = image_path
-    tgt = os.path.join(TEMP_IMAGE_PATH, filename)
-    shutil.copy(src, tgt)
-    return tgt
+    """ adds the image to the shared image store instead of copying it into the resources of the game """
+    return image_store.add_image(image_path)
 
 class MmMapWorldInstanceGenerator(GameInstanceGenerator):
     def __init__(self):
@@ -157,7 +139,6 @@ class MmMapWorldInstanceGenerator(GameInstanceGenerator):
             'large_cycle': {"size": "large", "reprompt": False, "one_shot": True, "cycle": True},
         }
         
-        prep_image_dir()
         for exp in experiments.keys():
              experiment = self.add_experiment(exp)
              game_id = 0
@@ -8,32 +8,53 @@ class AbstractMap(object):
                  'e': np.array((0, 1)),
                  'w': np.array((0, -1))}
 
-    def __init__(self, n, m, n_rooms):
+    # the same directions as integer offsets, indexed by the drawn direction
+    DX = (-1, 1, 0, 0)
+    DY = (0, 0, 1, -1)
+
+    def __init__(self, n, m, n_rooms, rng = None):
         if n*m < n_rooms:
             raise ValueError('n*m must be larger than n_rooms')
         self.n = n
         self.m = m
         self.n_rooms = n_rooms
-        self.G = self.make_graph(n, m, n_rooms)
-
-    def make_graph(self, n, m, n_rooms):
-        map_array = np.zeros((n, m))
-        G = nx.Graph()
+        if rng is None:
+            # derived from the global state, so np.random.seed still makes maps reproducible
+            rng = np.random.default_rng(np.random.randint(2**32, dtype=np.uint64))
+        self.G = self.make_graph(n, m, n_rooms, rng)
 
-        current_pos = np.random.randint(0, n), np.random.randint(0, m)
-        map_array[current_pos] = 1
-        G.add_node(current_pos)
+    @classmethod
+    def batch(cls, k, n, m, n_rooms, seed = None):
+        """ creates k maps from one random generator """
+        rng = np.random.default_rng(seed)
+        return [cls(n, m, n_rooms, rng) for _ in range(k)]
 
-        while map_array.sum() < n_rooms:
-            random_dir = np.random.choice(['n', 's', 'e', 'w'])
-            new_pos = tuple(np.array(current_pos) + self.dir2delta[random_dir])
-            if min(new_pos) < 0 or new_pos[0] >= n or new_pos[1] >= m:
-                # illegal move
-                continue
-            map_array[new_pos] = 1
-            G.add_node(new_pos)
-            G.add_edge(current_pos, new_pos)
-            current_pos = new_pos
+    def make_graph(self, n, m, n_rooms, rng):
+        # random walk on the grid until n_rooms different rooms have been
+        # visited, directions are drawn in batches
+        visited = bytearray(n * m)
+        x, y = int(rng.integers(n)), int(rng.integers(m))
+        visited[x * m + y] = 1
+        rooms = 1
+        edges = []
+        chunk = max(16, 4 * n_rooms)
+        while rooms < n_rooms:
+            for d in rng.integers(0, 4, size=chunk).tolist():
+                new_x = x + self.DX[d]
+                new_y = y + self.DY[d]
+                if new_x < 0 or new_y < 0 or new_x >= n or new_y >= m:
+                    # illegal move
+                    continue
+                if not visited[new_x * m + new_y]:
+                    visited[new_x * m + new_y] = 1
+                    rooms += 1
+                edges.append(((x, y), (new_x, new_y)))
+                x, y = new_x, new_y
+                if rooms == n_rooms:
+                    break
+        G = nx.Graph()
+        G.add_node(edges[0][0] if edges else (x, y))
+        G.add_edges_from(edges)
         return G
 
     def plot_graph(self):
@@ -2,14 +2,15 @@ from clemcore.clemgame import GameInstanceGenerator
 import sys
 import os
 sys.path.append(os.path.abspath('../clemgames/mm_mapworld'))
+sys.path.append(os.path.abspath('../clemgames'))
 from mm_mapworld_maps import AbstractMap
+import mm_mapworld_utils as utils
+import image_store
 
 import numpy as np
 import os
 import random
-import json
 import networkx as nx
-import shutil
 
 
 # set the name of the game in the script, as you named the directory
@@ -25,7 +26,6 @@ IMAGE_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_specifi
 # The dataset annotation is in english, making the language agnostic is going to be more challenging
 DATASET_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "ade_20k_reduced", "ade_imgs")
 MAPPING_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_main", "resources", "ade_20k_reduced", "cats.json")
-TEMP_IMAGE_PATH = os.path.join("..", "clemgames", "mm_mapworld", "mm_mapworld_specificroom", "resources", "images")
 RESPONSE_REGEX = "^\{[\s]*\"description\":\s*\"([^\{]*?)\"\s*,\s*\"action\":\s*\"([^\{]*?)\"[\s]*\}$"
 MOVE_CONSTRUCTION = "GO: "
 FOUND_REGEX = "^DONE$"
@@ -36,6 +36,8 @@ def create_instances(grid_size = GRIDS['large'], graph_size = SIZES['large'], nu
     instances = []
     np.random.seed(SEED)
     random.seed(SEED)
+    rng = np.random.default_rng(SEED)
+    categories = utils.load_category_index(MAPPING_PATH)
     for i in range(num_instances):
         this_dist = int(np.random.choice(goal_dist))
         start = None
@@ -46,20 +48,15 @@ def create_instances(grid_size = GRIDS['large'], graph_size = SIZES['large'], nu
             for node1 in dists:
                 for node2 in dists[node1]:
                     if dists[node1][node2] == this_dist:
-                        start = str(node1)
-                        target = str(node2)
-        nodes = [str(n) for n in map.G]
+                        start = node1
+                        target = node2
+        nodes = list(map.G)
         edges = list(map.G.edges())
         rev_edges = [(edge[1], edge[0]) for edge in edges]
         edges.extend(rev_edges)
-        img_ref, cat_ref = assign_images(nodes, target)
+        img_ref, cat_ref = assign_images(nodes, target, categories, rng)
         instances.append({
-            'nodes': nodes,
-            'edges': [str(e) for e in edges],
-            'imgs': img_ref,
-            'cats': cat_ref,
-            'start': start,
-            'target': target,
+            **utils.encode_instance(nodes, edges, img_ref, cat_ref, start, target),
             'target_cat': cat_ref[target],
             'dist': this_dist,
             'use_images': True,
@@ -69,22 +66,17 @@ def create_instances(grid_size = GRIDS['large'], graph_size = SIZES['large'], nu
         })
     return instances
 
-def assign_images(nodes, target, num_targets = 1):
-    with open(MAPPING_PATH, 'r', encoding='utf-8') as f:
-        mapping = json.load(f)
-    cats = mapping.keys()
-    cats_inside = [cat for cat in cats if 'outdoor' not in cat]
-    target_cat = np.random.choice(cats_inside)
-    cats_inside.remove(target_cat)
-    target_img = np.random.choice(mapping[target_cat])
+def assign_images(nodes, target, categories, rng, num_targets = 1):
+    target_cat = categories.sample_inside(rng)
+    target_img = categories.sample_images(rng, target_cat)
     after_copy_path = copy_image(os.path.join(DATASET_PATH, target_cat, target_img))
     imgs = {target: after_copy_path}
     cat_mapping = {target: target_cat}
-    for node in nodes:
-        if node == target:
-            continue
-        node_cat = np.random.choice(cats_inside)
-        node_img = np.random.choice(mapping[node_cat])
+    # no other room has the category of the target
+    others = [node for node in nodes if node != target]
+    node_cats = categories.sample_inside(rng, size=len(others), exclude=[target_cat])
+    for node, node_cat in zip(others, node_cats):
+        node_img = categories.sample_images(rng, node_cat)
         after_copy_path = copy_image(os.path.join(DATASET_PATH, node_cat, node_img))
         imgs[node] = after_copy_path
         cat_mapping[node] = node_cat
@@ -113,18 +105,9 @@ def instance_from_args(args, prompts):
         
     return instances   
 
-def prep_image_dir():
-    if os.path.exists(TEMP_IMAGE_PATH):
-        shutil.rmtree(TEMP_IMAGE_PATH)
-    os.makedirs(TEMP_IMAGE_PATH)
-    
 def copy_image(image_path):
-    filename = os.path.split(image_path)[1]
-    src = image_path
-    tgt = os.path.join(TEMP_IMAGE_PATH, filename)
-    shutil.copy(src, tgt)
-    return tgt   
-        
+    """ adds the image to the shared image store instead of copying it into the resources of the game """
+    return image_store.add_image(image_path)
 
 class MmMapWorldInstanceGenerator(GameInstanceGenerator):
     def __init__(self):
@@ -146,7 +129,6 @@ class MmMapWorldInstanceGenerator(GameInstanceGenerator):
             'far': {"dist": "far", "one_shot": True, "reprompt": False}
         }
 
-        prep_image_dir()
         for exp in experiments.keys():
              experiment = self.add_experiment(exp)
              game_id = 0
@@ -7,13 +7,13 @@ from queue import Queue
 from copy import deepcopy
 from time import sleep
 import numpy as np
-import matplotlib.pyplot as plt
-import imageio
-import shutil
 
 import sys
 sys.path.append(os.path.abspath('../clemgames/mm_mapworld'))
+sys.path.append(os.path.abspath('../clemgames'))
 import mm_mapworld_utils as utils
+import image_cache
+import map_visualizations
 from clemcore.backends import Model, CustomResponseModel
 from clemcore.clemgame import GameMaster, GameBenchmark, DialogueGameMaster, GameScorer, GameSpec
 from clemcore.clemgame import Player
@@ -23,6 +23,8 @@ from clemcore.clemgame.metrics import METRIC_ABORTED, METRIC_SUCCESS, METRIC_LOS
 DIRS = ["north", "south", "east", "west"]
 GAME_NAME = 'mm_mapworld_specificroom'
 MAX_TURNS = 20
+# leave the visualizations as a job in the episode directory instead of drawing them while scoring
+DEFER_VISUALIZATIONS = True
 
 CARDINAL_TO_DELTA = {
     'north': (0, 1),
@@ -42,6 +44,10 @@ class PathWalker(Player):
     def __init__(self, model: Model):
         super().__init__(model)
 
+    def __call__(self, messages, turn_idx):
+        # the history keeps the original images, the model gets the prepared copies
+        return super().__call__(image_cache.prepare_messages(messages, self.model), turn_idx)
+
     def _custom_response(self, messages, turn_idx) -> str:
         """Return a random direction."""
         random_dir = random.choice(DIRS)
@@ -49,12 +55,13 @@ class PathWalker(Player):
     
 
 class PathDescriber(Player):
-    def __init__(self, model, game_instance):
+    def __init__(self, model, game_instance, instance_key = None):
         super().__init__(model)
-        instance_data = utils.load_instance(game_instance)
+        instance_data = utils.load_instance(game_instance, instance_key)
         self.imgs = instance_data["imgs"]
         self.nodes = instance_data["nodes"]
         self.edges = instance_data["edges"]
+        self.adjacency = instance_data["adjacency"]
         self.start = instance_data["start"]
         self.cats = instance_data["cats"]
         self.target = instance_data["target"]
@@ -72,7 +79,7 @@ class PathDescriber(Player):
         self.invalid_move = False
         
     def get_available_moves(self, node):
-        return [edge for edge in self.edges if node == edge[0]]
+        return [(node, neighbor) for neighbor in self.adjacency[node].values()]
     
     def detect_loop(self):
         if len(self.visited_nodes) >= 4:
@@ -81,15 +88,11 @@ class PathDescriber(Player):
         return False
     
     def get_available_directions(self, node):
-        moves = self.get_available_moves(node)
-        deltas = [utils.edge_to_delta(move) for move in moves]
-        cardinals = [DELTA_TO_CARDINAL[delta] for delta in deltas]
-        return cardinals
+        return list(self.adjacency[node])
     
     def cardinal_room_change(self, cardinal):
-        delta = CARDINAL_TO_DELTA[cardinal]
-        new_room = (self.current_room[0] + delta[0], self.current_room[1] + delta[1])
-        if (self.current_room, new_room) in self.edges:
+        new_room = self.adjacency[self.current_room].get(cardinal)
+        if new_room is not None:
             self.current_room = new_room
 
     def _custom_response(self, messages, turn_idx) -> str:
@@ -122,29 +125,30 @@ class MmMapWorld(DialogueGameMaster):
         self.need_reprompt: bool = False
         self.did_reprompt: bool = False
         self.experiment = experiment['name']
+        # player -> indices of the messages in its history that carry images
+        self.image_messages = {}
+        self.game_name = game_name
         
     def get_available_moves(self, node):
-        return [edge for edge in self.edges if node == edge[0]]
+        return [(node, neighbor) for neighbor in self.adjacency[node].values()]
     
     def get_available_directions(self, node):
-        moves = self.get_available_moves(node)
-        deltas = [utils.edge_to_delta(move) for move in moves]
-        cardinals = [DELTA_TO_CARDINAL[delta] for delta in deltas]
-        return cardinals
+        return list(self.adjacency[node])
     
     def cardinal_room_change(self, cardinal):
-        delta = CARDINAL_TO_DELTA[cardinal]
-        new_room = (self.current_room[0] + delta[0], self.current_room[1] + delta[1])
-        if (self.current_room, new_room) in self.edges:
+        new_room = self.adjacency[self.current_room].get(cardinal)
+        if new_room is not None:
             self.current_room = new_room
                        
     def _on_setup(self, **game_instance):
         """" sets the information you specify in instances.json """
         self.game_instance = game_instance
-        instance_data = utils.load_instance(self.game_instance)
+        self.instance_key = utils.instance_key(self.game_name, self.experiment, game_instance)
+        instance_data = utils.load_instance(self.game_instance, self.instance_key)
         self.imgs = instance_data["imgs"]
         self.nodes = instance_data["nodes"]
         self.edges = instance_data["edges"]
+        self.adjacency = instance_data["adjacency"]
         self.cats = instance_data["cats"]
         self.target = instance_data["target"]
         self.target_cat = game_instance["target_cat"]
@@ -160,7 +164,7 @@ class MmMapWorld(DialogueGameMaster):
         self.do_reprompt = game_instance["reprompt"]
         self.reprompt_format = game_instance["reprompt_format"].replace("$GOAL$", self.target_cat)
 
-        self.describer = PathDescriber(CustomResponseModel(), game_instance)
+        self.describer = PathDescriber(CustomResponseModel(), game_instance, self.instance_key)
         self.walker = PathWalker(self.player_models[0])
         self.add_player(self.describer)
         self.add_player(self.walker)
@@ -295,17 +299,23 @@ class MmMapWorld(DialogueGameMaster):
     ########## Multimodal specific functions:
 
     def remove_previous_images(self, player: Player):
+        """ removes the images from all but the last message of the history,
+            only the messages known to carry images are visited """
         history = self.messages_by_names[player.descriptor]
-        for i in range(len(history)-1):
-            if "image" in history[i]:
-                del history[i]['image']
+        with_images = self.image_messages.setdefault(player.descriptor, [])
+        last = len(history) - 1
+        for i in with_images:
+            if i < last:
+                history[i].pop('image', None)
+        with_images[:] = [i for i in with_images if i >= last]
 
     def add_message(self, player: Player, utterance: str, role: str, image = None):
+        history = self.messages_by_names[player.descriptor]
         if image is None:
             message = {"role": role, "content": utterance}
         else:
             message = {"role": role, "content": utterance, "image": image}
-        history = self.messages_by_names[player.descriptor]
+            self.image_messages.setdefault(player.descriptor, []).append(len(history))
         history.append(message)
 
     def add_user_message(self, player: Player, utterance: str, **kwargs):
@@ -318,12 +328,15 @@ class MmMapWorld(DialogueGameMaster):
 class MM_MapWorldScorer(GameScorer):
     def __init__(self, game_name: str, experiment: Dict, game_instance: Dict):
         super().__init__(game_name, experiment, game_instance)
-        instance_data = utils.load_instance(self.game_instance)
+        instance_key = utils.instance_key(game_name, experiment['name'], game_instance)
+        instance_data = utils.load_instance(self.game_instance, instance_key)
         self.name = game_name
         self.imgs = instance_data["imgs"]
         self.nodes = instance_data["nodes"]
         self.edges = instance_data["edges"]
+        self.adjacency = instance_data["adjacency"]
         self.start_node = instance_data["start"]
+        self.defer_visualizations = DEFER_VISUALIZATIONS
         self.target = instance_data["target"]
         self.target_cat = game_instance['target_cat']
         self.cats = instance_data['cats']
@@ -331,16 +344,16 @@ class MM_MapWorldScorer(GameScorer):
         
         
     def adj(self, node):
-        return set([ed[1] for ed in self.edges if ed[0] == node])
+        return set(self.adjacency[node].values())
     
     def visited_all(self, visited, to_visit):
         return all([n in visited for n in to_visit])
     
     def get_available_moves(self, node, visited):
-        return [edge for edge in self.edges if node == edge[0] and (edge[0] in visited or edge[1] in visited)]
+        return [(node, neighbor) for neighbor in self.adjacency[node].values() if node in visited or neighbor in visited]
     
     def find_best_moves(self, current, visited):
-        to_visit = [ed[1] for ed in self.edges if ed[0] in visited and ed[1] not in visited]
+        to_visit = [neighbor for node in visited for neighbor in self.adjacency[node].values() if neighbor not in visited]
         start = [current]
         q = Queue()
         q.put(start)
@@ -372,65 +385,6 @@ class MM_MapWorldScorer(GameScorer):
                         q.put(new)
         return found
     
-    def plot_path(self, path):
-        offset = 0.05
-        fig = plt.figure(figsize=(4, 4))
-        for node in self.nodes:
-            if node in path and node != path[-1] and node != self.target:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:olive')
-            if node == path[-1] and node != self.target:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:cyan')
-            if node == self.target:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:orange')
-            if not node in path:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:gray')
-        plt.xlim(-1, 4)
-        plt.ylim(-1, 4)
-        traveled = {node: 0 for node in self.nodes}
-        traveled[self.start_node] += 1
-        for edge in self.edges:
-            if edge[0] in path and edge[1] in path:
-                plt.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='black', linestyle='--', zorder = 5)
-            else:
-                plt.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='gray', linestyle='--', zorder = 5)
-        last = path[0]
-        if len(path) > 1:
-            for i in range(1, len(path)):
-                if path[i] == path[i - 1]:
-                    continue
-                x1, y1 = last
-                x2, y2 = path[i]
-                dx = x2 - x1
-                dy = y2 - y1
-                t = traveled[path[i]]
-                traveled[path[i]] += 1
-                color = "black"
-                if i == len(path)-1:
-                    color = "red"
-                t = sum([(1/(1+j)) for j in range(t)])
-                plt.arrow(x1, 
-                        y1, 
-                        dx + t * offset, 
-                        dy + t * offset, 
-                        color=color, 
-                        width = 0.005, 
-                        head_width = 0.05, 
-                        length_includes_head = True, 
-                        zorder = 10)
-                last = (
-                    x1 + dx + t * offset,
-                    y1 + dy + t * offset
-                )
-        plt.xlabel('X')
-        plt.ylabel('Y')
-        plt.grid(True)
-        return fig
-
-
     def compute_scores(self, episode_interactions) -> None:
         current = self.start_node
         seen = {self.start_node}
@@ -516,25 +470,11 @@ class MM_MapWorldScorer(GameScorer):
                                 sub_dir=game_record_dir,
                                 root_dir=results_root)
         
-        # plotting & animation
-        if not os.path.exists("tmp"):
-            os.makedirs("tmp")
-        path_plot = self.plot_path(self.path)
-        path_plot.savefig(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "path.png"))
-        plt.close()
-        if not os.path.exists("tmp/step_plots"):
-            os.makedirs("tmp/step_plots")
-        images = []
-        for i in range(len(self.path)):
-            step_plot = self.plot_path(self.path[:i+1])
-            step_plot.savefig(f"tmp/step_plots/{i}.png")
-            images.append(imageio.imread(f"tmp/step_plots/{i}.png"))
-            plt.close()
-        imageio.mimsave(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "animation.gif"), images, fps=1, loop=True)
-        try:
-            shutil.rmtree("tmp")
-        except OSError as e:
-            print("Error: %s - %s." % (e.filename, e.strerror))
+        # plotting & animation, see map_visualizations.render_pending_visualizations
+        episode_dir = os.path.join(results_root, dialogue_pair, self.name, game_record_dir)
+        job = map_visualizations.visualization_job(self.nodes, self.edges, self.start_node, self.path,
+                                                   target = self.target)
+        map_visualizations.store_visualizations(job, episode_dir, defer = self.defer_visualizations)
         
         
                 
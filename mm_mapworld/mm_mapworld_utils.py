@@ -1,85 +1,197 @@
+import os
+import re
+import sys
+import json
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+sys.path.append(os.path.abspath('../clemgames'))
+import image_store
+
+DELTA_TO_CARDINAL = {
+    (0, 1): 'north',
+    (0,-1): 'south',
+    (1, 0): 'east',
+    (-1,0): 'west'
+}
+
+# version 1 serialized every tuple as a string ("(1, 2)", "((1, 2), (1, 3))") and
+# keyed imgs and cats by those strings; version 2 stores nodes and edges as int
+# lists and imgs and cats as lists in the order of the nodes
+INSTANCE_ENCODING = 2
+
+INT_PATTERN = re.compile(r'-?\d+')
+
+def parse_ints(serialized):
+    """ the ints in a version 1 string, e.g. "((1, 2), (1, 3))" -> (1, 2, 1, 3) """
+    return tuple(map(int, INT_PATTERN.findall(serialized)))
+
 def load_nodes(nodes):
         """ transforms the nodes in the instance 
             from strings to tuples of ints"""
-        loaded = []
-        for node in nodes:
-            without_brackets = node[1:-1]
-            nums = without_brackets.split(',')
-            tup = (int(nums[0].strip()), int(nums[1].strip()))
-            loaded.append(tup)
-        return loaded
+        return [parse_ints(node) for node in nodes]
     
 def load_edges(edges):
     """ transforms the edges in the instance 
         from strings to tuples of tuples of ints"""
     loaded = []
     for edge in edges:
-        edge = edge.replace('(', '')
-        edge = edge.replace(')', '')
-        nums = edge.split(',')
-        tup1 = (int(nums[0].strip()), int(nums[1].strip()))
-        tup2 = (int(nums[2].strip()), int(nums[3].strip()))
-        loaded.append((tup1, tup2))
+        nums = parse_ints(edge)
+        loaded.append((nums[:2], nums[2:]))
     return loaded
 
 def load_imgs(imgs):
     """ changes the keys for images from strings to 
-        tuples of ints """
+        tuples of ints and resolves the image paths """
     loaded = {}
     for key, value in imgs.items():
-        key_tup = load_nodes([key])[0]
-        loaded[key_tup] = value
+        loaded[parse_ints(key)] = image_store.resolve_image(value)
     return loaded
 
 def load_cats(cats):
     loaded = {}
     for key, value in cats.items():
-        key_tup = load_nodes([key])[0]
-        loaded[key_tup] = value
+        loaded[parse_ints(key)] = value
     return loaded
 
 def load_start(start):
     """ changes the starting node from string to a
         tuple of ints """
-    tup = load_nodes([start])[0]
-    return tup
+    return parse_ints(start)
         
-def load_instance(instance):
-    """The instance has been serialized using string for all the 
-    tuples. This function reverts this process by transforming the 
-    strings used to represent the graph as tuples of ints, so they
-    can be worked with. 
+def load_adjacency(nodes, edges):
+    """ node -> {cardinal -> neighbor}, the cardinals of a node are in 
+        the order of its edges """
+    adjacency = {node: {} for node in nodes}
+    for edge in edges:
+        adjacency[edge[0]][DELTA_TO_CARDINAL[edge_to_delta(edge)]] = edge[1]
+    return adjacency
+
+def encode_instance(nodes, edges, imgs, cats, start, target = None):
+    """ serializes a map for instances.json with the current encoding
 
     Args:
-        instance (dict): the current instance
+        nodes (list): the nodes, tuples of ints
+        edges (list): the edges, pairs of nodes
+        imgs (dict): node -> image
+        cats (dict): node -> category (or list of captioned images)
+        start (tuple): the starting node
+        target (tuple): the target node, if the game has one
     """
-    loaded_nodes = load_nodes(instance['nodes'])
-    loaded_edges = load_edges(instance['edges'])
-    loaded_imgs = load_imgs(instance['imgs'])
-    loaded_cats = load_cats(instance['cats'])
-    loaded_start = load_start(instance['start'])
-    if 'target' in instance:
-        loaded_target = load_start(instance['target'])
-        
-        return {
-            'nodes': loaded_nodes,
-            'edges': loaded_edges,
-            'imgs': loaded_imgs,
-            'start': loaded_start,
-            'cats': loaded_cats,
-            'target': loaded_target
+    encoded = {
+        'encoding': INSTANCE_ENCODING,
+        'nodes': [[int(node[0]), int(node[1])] for node in nodes],
+        'edges': [[int(edge[0][0]), int(edge[0][1]), int(edge[1][0]), int(edge[1][1])] for edge in edges],
+        'imgs': [imgs[node] for node in nodes],
+        'cats': [cats[node] for node in nodes],
+        'start': [int(start[0]), int(start[1])]
+    }
+    if target is not None:
+        encoded['target'] = [int(target[0]), int(target[1])]
+    return encoded
+
+def instance_images(instance):
+    """ the image references of a serialized instance, in any encoding """
+    imgs = instance['imgs']
+    return list(imgs.values()) if isinstance(imgs, dict) else list(imgs)
+
+def decode_instance(instance):
+    """ reverts the serialization of an instance, so nodes, edges, the start and
+        the target are tuples of ints and imgs and cats are keyed by node """
+    if instance.get('encoding', 1) == 1:
+        loaded = {
+            'nodes': load_nodes(instance['nodes']),
+            'edges': load_edges(instance['edges']),
+            'imgs': load_imgs(instance['imgs']),
+            'start': load_start(instance['start']),
+            'cats': load_cats(instance['cats'])
         }
+        if 'target' in instance:
+            loaded['target'] = load_start(instance['target'])
     else:
-         return {
-        'nodes': loaded_nodes,
-        'edges': loaded_edges,
-        'imgs': loaded_imgs,
-        'start': loaded_start,
-        'cats': loaded_cats
+        nodes = [(node[0], node[1]) for node in instance['nodes']]
+        loaded = {
+            'nodes': nodes,
+            'edges': [((e[0], e[1]), (e[2], e[3])) for e in instance['edges']],
+            'imgs': {node: image_store.resolve_image(img) for node, img in zip(nodes, instance['imgs'])},
+            'start': tuple(instance['start']),
+            'cats': dict(zip(nodes, instance['cats']))
         }
+        if 'target' in instance:
+            loaded['target'] = tuple(instance['target'])
+    loaded['adjacency'] = load_adjacency(loaded['nodes'], loaded['edges'])
+    return loaded
+
+# number of decoded instances kept per process
+MAX_LOADED_INSTANCES = 256
+
+def instance_key(game_name, experiment_name, instance):
+    """ identifies an instance across the game master, its players and the scorer
+        by its id; instances that reuse an id of the same game and experiment for
+        other content (other instance files) must not be loaded in the same process """
+    return (game_name, experiment_name, instance['game_id'])
+
+# key -> decoded instance, least recently used first
+_loaded_instances = OrderedDict()
+
+def load_instance(instance, key = None):
+    """The instance has been serialized using strings (version 1) or
+    lists of ints (version 2) for all the tuples. This function reverts
+    this process, so the graph can be worked with. With a key (see
+    instance_key), the last MAX_LOADED_INSTANCES decoded instances are
+    reused; the result is shared, so it must not be modified.
+
+    Args:
+        instance (dict): the current instance
+        key (tuple): identifies the instance, None decodes it every time
+    """
+    if key is None:
+        return decode_instance(instance)
+    loaded = _loaded_instances.get(key)
+    if loaded is None:
+        loaded = _loaded_instances[key] = decode_instance(instance)
+        if len(_loaded_instances) > MAX_LOADED_INSTANCES:
+            _loaded_instances.popitem(last=False)
+    else:
+        _loaded_instances.move_to_end(key)
+    return loaded
          
     
 def edge_to_delta(edge):
         dx = edge[1][0] - edge[0][0]
         dy = edge[1][1] - edge[0][1]
-        return (dx, dy)
\ No newline at end of file
+        return (dx, dy)
+
+
+class CategoryIndex:
+    """ADE20K category mapping (category -> images, or image -> caption),
+    read once per generator run. The indoor categories and the images of
+    every category are kept as arrays, so sampling for an instance does
+    not touch the json file or rebuild any list.
+
+    Args:
+        mapping (dict): the content of cats.json, captions.json or ade_cat_instances.json
+    """
+    def __init__(self, mapping):
+        self.mapping = mapping
+        # outdoor images don't make too much sense for rooms in a house
+        self.inside = np.array([cat for cat in mapping if 'outdoor' not in cat])
+        self.images = {cat: np.array(imgs) for cat, imgs in mapping.items() if isinstance(imgs, list)}
+
+    def sample_inside(self, rng, size = None, replace = True, exclude = None):
+        """ samples indoor categories (or captioned images), optionally leaving out some """
+        pool = self.inside
+        if exclude is not None and len(exclude):
+            pool = pool[~np.isin(pool, exclude)]
+        return rng.choice(pool, size = size, replace = replace).tolist()
+
+    def sample_images(self, rng, cat, size = None):
+        """ samples images of a category (with replacement, like the generators always did) """
+        return rng.choice(self.images[cat], size = size).tolist()
+
+
+@lru_cache(maxsize = None)
+def load_category_index(mapping_path):
+    """ loads a category mapping once per process """
+    with open(mapping_path, 'r', encoding='utf-8') as f:
+        return CategoryIndex(json.load(f))
@@ -4,9 +4,10 @@ from maps import AbstractMap
 import os
 import random
 import json
+from functools import lru_cache
 import networkx as nx
-from copy import deepcopy
-import shutil
+
+import games.image_store as image_store
 
 
 # set the name of the game in the script, as you named the directory
@@ -23,7 +24,8 @@ IMAGE_PATH = os.path.join('games', 'mm_mapworld', 'resources', 'images')
 # The dataset annotation is in english, making the language agnostic is going to be more challenging
 MAPPING_PATH = os.path.join("games", "mm_mapworld", "resources", "ade_20k", "ade_cat_instances.json")
 DATASET_PATH = os.path.join("games", "mm_mapworld", "resources", "ade_20k", "needed_imgs")
-TEMP_IMAGE_PATH = os.path.join("games", "mm_mapworld_qa", "resources", "images")
+# the shared image store, seen from the clembench root the generator runs in
+STORE_DIR = os.path.join("games", image_store.STORE_NAME)
 RESPONSE_REGEX = "^\{[\s]*\"description\":\s*\"([^\{]*?)\"\s*,\s*\"action\":\s*\"([^\{]*?)\"[\s]*\}$"
 MOVE_CONSTRUCTION = "GO: "
 FOUND_REGEX = "^DONE$"
@@ -36,6 +38,8 @@ def create_instances(grid_size = GRIDS['large'], graph_size = SIZES['medium'], n
     instances = []
     np.random.seed(SEED)
     random.seed(SEED)
+    rng = np.random.default_rng(SEED)
+    categories = CategoryIndex.load(MAPPING_PATH)
     for i in range(num_instances):
         map = AbstractMap(*grid_size, graph_size)
         nodes = [str(n) for n in map.G]
@@ -45,7 +49,7 @@ def create_instances(grid_size = GRIDS['large'], graph_size = SIZES['medium'], n
         edges.extend(rev_edges)
         index = np.random.randint(len(ambiguity))
         this_ambiguity = ambiguity[index]
-        img_ref, cat_ref, questions = assign_images(nodes, this_ambiguity)
+        img_ref, cat_ref, questions = assign_images(nodes, this_ambiguity, categories, rng)
         instances.append({
             'nodes': nodes,
             'edges': [str(e) for e in edges],
@@ -61,21 +65,44 @@ def create_instances(grid_size = GRIDS['large'], graph_size = SIZES['medium'], n
         })
     return instances
 
-def assign_images(nodes, ambiguity, num_targets = 1):
-    # load the category file
-    with open(MAPPING_PATH, 'r', encoding='utf-8') as f:
-        mapping = json.load(f)
-    cats = mapping.keys()
-    # outdoor images don't make too much sense for rooms in a house
-    cats_inside = [cat for cat in cats if 'outdoor' not in cat]
+class CategoryIndex:
+    """ADE20K category mapping (category -> images), read once per
+    generator run. The indoor categories and the images of every category
+    are kept as arrays, so sampling for an instance does not touch the
+    json file or rebuild any list.
+
+    Args:
+        mapping (dict): the content of ade_cat_instances.json
+    """
+    def __init__(self, mapping):
+        self.mapping = mapping
+        # outdoor images don't make too much sense for rooms in a house
+        self.inside = np.array([cat for cat in mapping if 'outdoor' not in cat])
+        self.images = {cat: np.array(imgs) for cat, imgs in mapping.items()}
+
+    @classmethod
+    @lru_cache(maxsize = None)
+    def load(cls, mapping_path):
+        with open(mapping_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def sample_inside(self, rng, size = None, replace = True, exclude = None):
+        """ samples indoor categories, optionally leaving out some """
+        pool = self.inside
+        if exclude is not None and len(exclude):
+            pool = pool[~np.isin(pool, exclude)]
+        return rng.choice(pool, size = size, replace = replace).tolist()
+
+    def sample_images(self, rng, cat, size = None):
+        return rng.choice(self.images[cat], size = size).tolist()
+
+
+def assign_images(nodes, ambiguity, categories, rng, num_targets = 1):
     num_cats_needed = len(nodes) - (ambiguity[0] * (ambiguity[1] - 1))
-    chosen_cats = np.random.choice(cats_inside, size = num_cats_needed, replace = False)
-    # make sure the decoy category does not exist on the graph
-    for c in chosen_cats:
-        cats_inside.remove(c)
-    chosen_cats = list(chosen_cats)
+    chosen_cats = categories.sample_inside(rng, size = num_cats_needed, replace = False)
+    # make sure the decoy category does not exist on the graph,
     # choose it randomly from the rest of the categories
-    decoy = np.random.choice(cats_inside)
+    decoy = categories.sample_inside(rng, exclude = chosen_cats)
     imgs = {}
     cat_mapping = {}
     targets = chosen_cats[:2]
@@ -92,10 +119,10 @@ def assign_images(nodes, ambiguity, num_targets = 1):
     questions = []
     for target in targets:
         questions.append({"q": f"How many different {target.replace('_', ' ')}(s) did we encounter?", "a": str(targets[target])})
-    nodes_copy = deepcopy(nodes)
+    nodes_copy = list(nodes)
     for c in chosen_cats:
-        chosen_nodes = list(np.random.choice(nodes_copy, size=nodes_per_cat[c], replace = False))
-        chosen_imgs = np.random.choice(mapping[c], size=nodes_per_cat[c])
+        chosen_nodes = rng.choice(nodes_copy, size=nodes_per_cat[c], replace = False).tolist()
+        chosen_imgs = categories.sample_images(rng, c, size=nodes_per_cat[c])
         for i in range(len(chosen_nodes)):
             after_copy_path = copy_image(os.path.join(DATASET_PATH, chosen_imgs[i]))
             imgs[chosen_nodes[i]] = after_copy_path
@@ -127,17 +154,9 @@ def instance_from_args(args, prompts):
         
     return instances      
         
-def prep_image_dir():
-    if os.path.exists(TEMP_IMAGE_PATH):
-        shutil.rmtree(TEMP_IMAGE_PATH)
-    os.makedirs(TEMP_IMAGE_PATH)
-    
 def copy_image(image_path):
-    filename = os.path.split(image_path)[1]
-    src = image_path
-    tgt = os.path.join(TEMP_IMAGE_PATH, filename)
-    shutil.copy(src, tgt)
-    return tgt
+    """ adds the image to the shared image store instead of copying it into the resources of the game """
+    return image_store.add_image(image_path, STORE_DIR)
 
 class MmMapWorldQAInstanceGenerator(GameInstanceGenerator):
     def __init__(self):
@@ -161,7 +180,6 @@ class MmMapWorldQAInstanceGenerator(GameInstanceGenerator):
             'strong': {"ambiguity": "strong", "one_shot": True, "reprompt": False}
         }
 
-        prep_image_dir()
         for exp in experiments.keys():
              experiment = self.add_experiment(exp)
              game_id = 0
@@ -6,12 +6,12 @@ import json
 from queue import Queue
 from copy import deepcopy
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-import imageio
-import shutil
 
 import games.mm_mapworld_qa.utils as utils
+import games.map_visualizations as map_visualizations
+import games.image_cache as image_cache
 
 import clemgame.metrics as ms
 from backends import Model, CustomResponseModel
@@ -25,6 +25,12 @@ from clemgame.metrics import METRIC_ABORTED, METRIC_SUCCESS, METRIC_LOSE, BENCH_
 DIRS = ["north", "south", "east", "west"]
 GAME_NAME = 'mm_mapworld_qa'
 MAX_TURNS = 20
+# leave the visualizations as a job in the episode directory instead of drawing them while scoring
+DEFER_VISUALIZATIONS = True
+# ask all questions at once, each as its own continuation of the exploration history,
+# instead of one per turn (can be set per instance with "forked_qa"); the backend of
+# the walker has to allow concurrent calls
+FORKED_QA = False
 
 CARDINAL_TO_DELTA = {
     'north': (0, 1),
@@ -44,6 +50,10 @@ class PathWalker(Player):
     def __init__(self, model: Model):
         super().__init__(model)
 
+    def __call__(self, messages, turn_idx):
+        # the history keeps the original images, the model gets the prepared copies
+        return super().__call__(image_cache.prepare_messages(messages, self.model), turn_idx)
+
     def _custom_response(self, messages, turn_idx) -> str:
         """Return a random direction."""
         random_dir = random.choice(DIRS)
@@ -115,12 +125,16 @@ class PathDescriber(Player):
                 #     response = self.limit_warning + response
             return response
         else:
-            response = ''
-            if self.phase_1_turn == 0:
-                response += self.qa_init_prompt
-            response += ' '
-            response += self.questions[self.phase_1_turn]['q']
-            return response 
+            return self.question_prompt(self.phase_1_turn, self.phase_1_turn == 0)
+
+    def question_prompt(self, idx, with_init):
+        """ the prompt asking question idx, the first question also explains the QA phase """
+        response = ''
+        if with_init:
+            response += self.qa_init_prompt
+        response += ' '
+        response += self.questions[idx]['q']
+        return response
 
         
 class MmMapWorldQA(DialogueGameMaster):
@@ -134,6 +148,8 @@ class MmMapWorldQA(DialogueGameMaster):
         self.need_reprompt: bool = False
         self.did_reprompt: bool = False
         self.experiment = experiment['name']
+        # player -> indices of the messages in its history that carry images
+        self.image_messages = {}
         self.game_finished: bool = False
         
         # game version specific
@@ -183,6 +199,7 @@ class MmMapWorldQA(DialogueGameMaster):
         # game version specific 
         self.describer.phase = 0
         self.qa_regex = re.compile(game_instance["qa_regex"], re.IGNORECASE)
+        self.forked_qa = game_instance.get("forked_qa", FORKED_QA)
         
 
     def _on_before_game(self):
@@ -194,11 +211,14 @@ class MmMapWorldQA(DialogueGameMaster):
         self.add_user_message(self.describer, begin_message)
             
     def _on_before_turn(self, turn_idx: int):
-        img_path = 'games/mm_mapworld_qa/resources/images/'
+        # the instance refers to the image itself (in the image store or the resources)
         value = {
-            "image": [img_path + os.path.split(self.imgs[self.current_room])[1]]
+            "image": [self.imgs[self.current_room]]
         }
         self.log_to_self("room_image", json.dumps(value))
+        if self.phase == 1 and self.forked_qa:
+            self.answer_questions_forked()
+            self.game_finished = True
  
     def _does_game_proceed(self):
         if self.aborted: # game was aborted at some point
@@ -344,22 +364,54 @@ class MmMapWorldQA(DialogueGameMaster):
         self.did_reprompt = False
         
             
+    def answer_questions_forked(self):
+        """ asks all questions concurrently, each appended to its own copy of the 
+            exploration history of the walker; the exchanges are logged and the
+            answers validated in the order of the questions """
+        history = self.messages_by_names[self.walker.descriptor]
+        questions = [self.describer.question_prompt(i, True) for i in range(len(self.describer.questions))]
+        forks = []
+        for question in questions:
+            fork = [{key: value for key, value in message.items() if key != 'image'} for message in history]
+            fork.append({"role": "user", "content": question})
+            forks.append(fork)
+        if not forks:
+            return
+        with ThreadPoolExecutor(max_workers = len(forks)) as executor:
+            calls = list(executor.map(lambda fork: self.walker(fork, self.current_turn), forks))
+        for question, (prompt, response_object, utterance) in zip(questions, calls):
+            action = {'type': 'send message', 'content': question}
+            self.log_event(from_='GM', to=self.walker.descriptor, action=action)
+            action = {'type': 'get message', 'content': utterance}
+            self.log_event(from_=self.walker.descriptor, to='GM', action=action, 
+                           call=(deepcopy(prompt), response_object))
+            # like in the sequential mode, no answer counts after an invalid one
+            if not self.aborted:
+                utterance, _ = self._on_parse_response(self.walker, utterance)
+                self._validate_player_response(self.walker, utterance)
+
     def _on_after_game(self):
         self.log_to_self("answers", json.dumps(self.answers))
 
     ########## Multimodal specific functions:
 
     def remove_previous_images(self, player: Player):
+        """ removes the images from all but the last message of the history,
+            only the messages known to carry images are visited """
         history = self.messages_by_names[player.descriptor]
-        for i in range(len(history)-1):
-            if "image" in history[i]:
-                del history[i]['image']
+        with_images = self.image_messages.setdefault(player.descriptor, [])
+        last = len(history) - 1
+        for i in with_images:
+            if i < last:
+                history[i].pop('image', None)
+        with_images[:] = [i for i in with_images if i >= last]
 
     def add_message(self, player: Player, utterance: str, role: str, **kwargs):
         message = {"role": role, "content": utterance}
+        history = self.messages_by_names[player.descriptor]
         if 'image' in kwargs:
             message['image'] = kwargs['image']
-        history = self.messages_by_names[player.descriptor]
+            self.image_messages.setdefault(player.descriptor, []).append(len(history))
         history.append(message)
 
     def add_user_message(self, player: Player, utterance: str, **kwargs):
@@ -378,6 +430,7 @@ class MM_MapWorldQAScorer(GameScorer):
         self.edges = instance_data["edges"]
         self.start_node = instance_data["start"]
         self.cats = instance_data['cats']
+        self.defer_visualizations = DEFER_VISUALIZATIONS
         self.questions = game_instance['questions']
         
     def adj(self, node):
@@ -515,86 +568,16 @@ class MM_MapWorldQAScorer(GameScorer):
                 self.log_episode_score(BENCH_SCORE, 100*h_mean)
 
 
-    def plot_path(self, path):
-        offset = 0.05
-        fig = plt.figure(figsize=(4, 4))
-        for node in self.nodes:
-            if node in path and node != path[-1]:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:olive')
-            if node == path[-1]:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:cyan')
-            if not node in path:
-                plt.plot(node[0], node[1], 'o', color='brown', 
-                        linewidth = 20, markersize = 25, zorder = 9, mfc = 'tab:gray')
-        plt.xlim(-1, 4)
-        plt.ylim(-1, 4)
-        traveled = {node: 0 for node in self.nodes}
-        traveled[self.start_node] += 1
-        for edge in self.edges:
-            if edge[0] in path and edge[1] in path:
-                plt.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='black', linestyle='--', zorder = 5)
-            else:
-                plt.plot([edge[0][0], edge[1][0]], [edge[0][1], edge[1][1]], color='gray', linestyle='--', zorder = 5)
-        last = path[0]
-        if len(path) > 1:
-            for i in range(1, len(path)):
-                if path[i] == path[i - 1]:
-                    continue
-                x1, y1 = last
-                x2, y2 = path[i]
-                dx = x2 - x1
-                dy = y2 - y1
-                t = traveled[path[i]]
-                traveled[path[i]] += 1
-                color = "black"
-                if i == len(path)-1:
-                    color = "red"
-                t = sum([(1/(1+j)) for j in range(t)])
-                plt.arrow(x1, 
-                        y1, 
-                        dx + t * offset, 
-                        dy + t * offset, 
-                        color=color, 
-                        width = 0.005, 
-                        head_width = 0.05, 
-                        length_includes_head = True, 
-                        zorder = 10)
-                last = (
-                    x1 + dx + t * offset,
-                    y1 + dy + t * offset
-                )
-        plt.xlabel('X')
-        plt.ylabel('Y')
-        plt.grid(True)
-        return fig
-     
     def store_scores(self, results_root: str, dialogue_pair: str, game_record_dir: str):
         self.store_results_file(self.scores, "scores.json",
                                 dialogue_pair=dialogue_pair,
                                 sub_dir=game_record_dir,
                                 root_dir=results_root)
         
-        # plotting & animation
-        if not os.path.exists("tmp"):
-            os.makedirs("tmp")
-        path_plot = self.plot_path(self.path)
-        path_plot.savefig(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "path.png"))
-        plt.close()
-        if not os.path.exists("tmp/step_plots"):
-            os.makedirs("tmp/step_plots")
-        images = []
-        for i in range(len(self.path)):
-            step_plot = self.plot_path(self.path[:i+1])
-            step_plot.savefig(f"tmp/step_plots/{i}.png")
-            images.append(imageio.imread(f"tmp/step_plots/{i}.png"))
-            plt.close()
-        imageio.mimsave(os.path.join(results_root, dialogue_pair, self.name, game_record_dir, "animation.gif"), images, fps=1, loop=True)
-        try:
-            shutil.rmtree("tmp")
-        except OSError as e:
-            print("Error: %s - %s." % (e.filename, e.strerror))
+        # plotting & animation, see map_visualizations.render_pending_visualizations
+        episode_dir = os.path.join(results_root, dialogue_pair, self.name, game_record_dir)
+        job = map_visualizations.visualization_job(self.nodes, self.edges, self.start_node, self.path)
+        map_visualizations.store_visualizations(job, episode_dir, defer = self.defer_visualizations)
         
         
                 
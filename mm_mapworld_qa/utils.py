@@ -1,3 +1,5 @@
+import games.image_store as image_store
+
 def load_nodes(nodes):
         """ transforms the nodes in the instance 
             from strings to tuples of ints"""
@@ -24,11 +26,11 @@ def load_edges(edges):
 
 def load_imgs(imgs):
     """ changes the keys for images from strings to 
-        tuples of ints """
+        tuples of ints and resolves the image paths """
     loaded = {}
     for key, value in imgs.items():
         key_tup = load_nodes([key])[0]
-        loaded[key_tup] = value
+        loaded[key_tup] = image_store.resolve_image(value)
     return loaded
 
 def load_cats(cats):
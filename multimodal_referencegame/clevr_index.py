@@ -0,0 +1,270 @@
+"""
+Category index of the CLEVR scenes for the multimodal referencegame
+
+The category of an object is "size color shape material". The index maps every
+image (with integer ids in the order of the scene files) to the categories of its
+objects and every category to the images showing it. Only images that exist on
+disk are indexed, checked against one listing of each image directory.
+
+Parsing the scene files (~100 MB) takes a while, so the index is stored in a
+pickle next to them and reused as long as the scene files and image directories
+didn't change (same size and modification time).
+
+DistractorSearch finds the images sharing the most categories with a target through
+a sparse image x category incidence matrix: the overlap of a target with all images
+is one sparse matrix-vector product (matrix-matrix for a batch of targets).
+
+Usage (from the game directory):
+
+    category2image, image2category = clevr_index.load_index().to_dicts()
+    distractors = clevr_index.DistractorSearch(category2image, image2category)
+"""
+import os
+import json
+import pickle
+import logging
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+CLEVR_DIR = os.path.join('resources', 'CLEVR_v1.0')
+# scene file and image directory of every split
+SPLITS = [('CLEVR_train_scenes.json', 'train'), ('CLEVR_val_scenes.json', 'val')]
+CACHE_FILE = 'clevr_index.pkl'
+# increase when the stored format changes
+CACHE_VERSION = 1
+# number of targets whose overlaps with all images are computed at once
+TARGET_BLOCK = 64
+
+
+def object_category(obj):
+    return obj['size'] + ' ' + obj['color'] + ' ' + obj['shape'] + ' ' + obj['material']
+
+
+class ClevrIndex:
+
+    def __init__(self, images, categories, image_categories):
+        """
+        :param images: image paths, the position in the list is the image id
+        :param categories: category names, the position in the list is the category id
+        :param image_categories: category ids of every image, in the order of its objects
+        """
+        self.images = images
+        self.categories = categories
+        self.image_categories = image_categories
+        self.category_images = [[] for _ in categories]
+        for image_id, category_ids in enumerate(image_categories):
+            for category_id in category_ids:
+                self.category_images[category_id].append(image_id)
+
+    @classmethod
+    def from_scenes(cls, clevr_dir=CLEVR_DIR):
+        images = []
+        categories = []
+        image_categories = []
+        image_ids = {}
+        category_ids = {}
+        for scene_file, split in SPLITS:
+            image_dir = os.path.join(clevr_dir, 'images', split)
+            existing = set(os.listdir(image_dir)) if os.path.isdir(image_dir) else set()
+            with open(os.path.join(clevr_dir, 'scenes', scene_file), 'r') as f:
+                scenes = json.load(f)['scenes']
+            for scene in scenes:
+                if scene['image_filename'] not in existing:
+                    continue
+                image_path = os.path.join(image_dir, scene['image_filename'])
+                if image_path not in image_ids:
+                    image_ids[image_path] = len(images)
+                    images.append(image_path)
+                    image_categories.append([])
+                # the categories of an image are few, a list keeps their order
+                categories_of_image = image_categories[image_ids[image_path]]
+                for obj in scene['objects']:
+                    category = object_category(obj)
+                    if category not in category_ids:
+                        category_ids[category] = len(categories)
+                        categories.append(category)
+                    if category_ids[category] not in categories_of_image:
+                        categories_of_image.append(category_ids[category])
+        return cls(images, categories, [tuple(ids) for ids in image_categories])
+
+    def to_dicts(self):
+        """
+        :return: category2image (category -> image paths) and image2category (image path -> categories),
+                 new lists that callers may change; categories and images are in the order of the scene files
+        """
+        category2image = {category: [self.images[i] for i in self.category_images[category_id]]
+                          for category_id, category in enumerate(self.categories)}
+        image2category = {image: [self.categories[i] for i in self.image_categories[image_id]]
+                          for image_id, image in enumerate(self.images)}
+        return category2image, image2category
+
+
+def source_key(clevr_dir=CLEVR_DIR):
+    """ size and modification time of the scene files and image directories the index is built from """
+    key = [CACHE_VERSION]
+    for scene_file, split in SPLITS:
+        for path in [os.path.join(clevr_dir, 'scenes', scene_file), os.path.join(clevr_dir, 'images', split)]:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                key.append((path, stat.st_size, stat.st_mtime_ns))
+            else:
+                key.append((path, None, None))
+    return key
+
+
+def load_index(clevr_dir=CLEVR_DIR, cache_path=None):
+    """
+    Load the index from the cache, or build it from the scene files and update the cache
+    :param clevr_dir: directory of the CLEVR dataset
+    :param cache_path: pickle file of the index, by default CACHE_FILE in clevr_dir
+    :return: ClevrIndex
+    """
+    if cache_path is None:
+        cache_path = os.path.join(clevr_dir, CACHE_FILE)
+    key = source_key(clevr_dir)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['key'] == key:
+                return ClevrIndex(cached['images'], cached['categories'], cached['image_categories'])
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable CLEVR index cache {cache_path}: {e}")
+    index = ClevrIndex.from_scenes(clevr_dir)
+    try:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': key, 'images': index.images, 'categories': index.categories,
+                         'image_categories': index.image_categories}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not store the CLEVR index cache {cache_path}: {e}")
+    return index
+
+
+class DistractorSearch:
+    """
+    Selects distractors for CLEVR targets, see select. Works on the dicts of
+    ClevrIndex.to_dicts and keeps them in sync: images that are used up are
+    removed with pop_image and remove_from_category instead of changing the dicts.
+    """
+
+    def __init__(self, category2image, image2category):
+        """
+        :param category2image: category -> image paths, every list in the order of image2category
+        :param image2category: image path -> categories, all images that can be selected
+        """
+        self.category2image = category2image
+        self.image2category = image2category
+        self.images = list(image2category)
+        self.image_ids = {image: image_id for image_id, image in enumerate(self.images)}
+        self.category_ids = {category: category_id for category_id, category in enumerate(category2image)}
+        # image x category: the categories of every image
+        self.categories = self.incidence((image, image2category[image]) for image in self.images)
+        # image x category: the position of every category in the list of the image (from 1)
+        self.category_ranks = self.incidence(((image, image2category[image]) for image in self.images), ranked=True)
+        # image x category: the images still listed under every category
+        self.listed = self.incidence((image, [category]) for category, images in category2image.items()
+                                     for image in images if image in self.image_ids)
+        self.available = np.ones(len(self.images), dtype=bool)
+
+    def incidence(self, pairs, ranked=False):
+        rows = []
+        columns = []
+        ranks = []
+        for image, categories in pairs:
+            for rank, category in enumerate(categories, start=1):
+                rows.append(self.image_ids[image])
+                columns.append(self.category_ids[category])
+                ranks.append(rank)
+        if ranked:
+            # the categories of an image are unique, no pair repeats
+            return sparse.csr_matrix((np.array(ranks, dtype=np.int64), (rows, columns)),
+                                     shape=(len(self.images), len(self.category_ids)))
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                   shape=(len(self.images), len(self.category_ids)))
+        # repeated pairs count once
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix
+
+    def target_vector(self, target_categories):
+        vector = np.zeros(len(self.category_ids), dtype=np.int32)
+        vector[[self.category_ids[category] for category in target_categories]] = 1
+        return vector
+
+    def select(self, target_categories):
+        """
+        The available image with the most categories in common with the target, found
+        in the lists of the target categories (in their order) like the original loop over them
+        :param target_categories: categories of the target image
+        :return: image path, '' if no available image shares a category with the target
+        """
+        target = self.target_vector(target_categories)
+        reachable = (self.listed @ target) > 0
+        overlap = np.where(self.available & reachable, self.categories @ target, 0)
+        if len(overlap) == 0 or overlap.max() == 0:
+            return ''
+        ties = np.flatnonzero(overlap == overlap.max())
+        if len(ties) > 1:
+            # the first image in the list of the first target category listing one of them
+            listed = self.listed[ties][:, [self.category_ids[category] for category in target_categories]]
+            first_category = listed.indices.min()
+            ties = ties[listed[:, first_category].nonzero()[0]]
+        return self.images[ties.min()]
+
+    def nearest(self, target_images, k=2):
+        """
+        The k available images with the most categories in common with each of many targets,
+        computed for blocks of targets at once. Ties are broken like in select, so the images
+        are the ones that k calls of select (each followed by pop_image) would return.
+        :param target_images: image paths of the targets
+        :param k: number of distractors per target
+        :return: list of up to k image paths per target, most similar first (images that
+                 share no category with a target are left out)
+        """
+        target_ids = np.array([self.image_ids[image] for image in target_images], dtype=np.int64)
+        n_images = len(self.images)
+        max_rank = int(self.category_ranks.max()) if self.category_ranks.nnz else 0
+        selected = []
+        for start in range(0, len(target_ids), TARGET_BLOCK):
+            block = target_ids[start:start + TARGET_BLOCK]
+            targets = self.categories[block].T
+            overlap = (self.categories @ targets).toarray().astype(np.int64)
+            # the target categories listing an image as bits, the earliest one is the highest bit
+            ranks = self.category_ranks[block].T.tocsc(copy=True)
+            ranks.data = np.left_shift(1, max_rank - ranks.data)
+            listing = (self.listed @ ranks).toarray()
+            reachable = listing > 0
+            # position of the first target category listing the image (select's tie break)
+            first_rank = max_rank + 1 - np.frexp(np.maximum(listing, 1).astype(np.float64))[1]
+            # unique keys, larger for more overlap, an earlier first category and earlier images
+            keys = ((overlap * (max_rank + 1) + (max_rank + 1 - first_rank)) * n_images
+                    + (n_images - 1 - np.arange(n_images))[:, None])
+            keys[~(self.available[:, None] & reachable & (overlap > 0))] = -1
+            # a target is no distractor of itself
+            keys[block, np.arange(len(block))] = -1
+            top = min(k, n_images)
+            closest = np.argpartition(-keys, top - 1, axis=0)[:top]
+            closest = np.take_along_axis(closest, np.argsort(-np.take_along_axis(keys, closest, axis=0), axis=0),
+                                         axis=0)
+            for column in range(len(block)):
+                selected.append([self.images[i] for i in closest[:, column] if keys[i, column] >= 0])
+        return selected
+
+    def pop_image(self, image):
+        """ removes an image from image2category, so it is never selected again """
+        categories = self.image2category.pop(image)
+        self.available[self.image_ids[image]] = False
+        return categories
+
+    def remove_from_category(self, image, category):
+        """ removes an image from the list of a category in category2image """
+        self.category2image[category].remove(image)
+        if image in self.image_ids:
+            self.listed[self.image_ids[image], self.category_ids[category]] = 0
+            # the assignment keeps an explicit zero, select must only see the images still listed
+            self.listed.eliminate_zeros()
+
@@ -1,8 +1,13 @@
+import os
+import sys
 import random
 from typing import Dict, List
 
 from clemcore.clemgame import Player
 
+sys.path.append(os.path.abspath('../clemgames'))
+import image_cache
+
 
 class Instruction:
 
@@ -51,7 +56,8 @@ class InstructionFollower(Player):
         super().__init__(model_name)
 
     def __call__(self, instruction: Instruction, turn_idx):
-        return super().__call__(instruction.convert_to_query_messages(), turn_idx)
+        messages = image_cache.prepare_messages(instruction.convert_to_query_messages(), self.model)
+        return super().__call__(messages, turn_idx)
 
     def _custom_response(self, messages, turn_idx):
         answer = random.choice(["first", "second", "third"])
@@ -64,7 +70,8 @@ class InstructionGiver(Player):
         super().__init__(model_name)
 
     def __call__(self, instruction: Instruction, turn_idx):
-        return super().__call__(instruction.convert_to_query_messages(), turn_idx)
+        messages = image_cache.prepare_messages(instruction.convert_to_query_messages(), self.model)
+        return super().__call__(messages, turn_idx)
 
     def _custom_response(self, messages, turn_idx):
         return "Expression: The one that looks like the target."
@@ -6,9 +6,12 @@ Reads grids_v1.5.json from resources/ (grids don't change in this version)
 Creates instances.json in instances/
 """
 import os
+import sys
 import random
 from clemcore.clemgame import GameInstanceGenerator
-import shutil
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import image_store
+import clevr_index
 import matplotlib.pyplot as plt
 import json
 import logging
@@ -65,42 +68,8 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
         return dataset
 
     def get_clevr_dataset(self):
-
-        files_to_process = ['CLEVR_train_scenes.json', 'CLEVR_val_scenes.json']
-        category2image = dict()
-        image2category = dict()
-
-        for file in files_to_process:
-            data = self.load_json(os.path.join('resources', 'CLEVR_v1.0', 'scenes', file))
-
-            for scene in data['scenes']:
-
-                if file == 'CLEVR_train_scenes.json':
-                    image_path = os.path.join('resources', 'CLEVR_v1.0', 'images', 'train', scene['image_filename'])
-                else:
-                    image_path = os.path.join('resources', 'CLEVR_v1.0', 'images', 'val', scene['image_filename'])
-
-                if os.path.exists(image_path) == False:
-                    continue
-
-                for object in scene['objects']:
-
-                    image_category = object['size']+ ' '+object['color']+' '+object['shape'] +' '+object['material']
-
-                    if image_category not in category2image:
-                        category2image[image_category] = [image_path]
-                    else:
-                        if image_path not in category2image[image_category]:
-                            category2image[image_category].append(image_path)
-
-                    if image_path not in image2category:
-                        image2category[image_path] = [image_category]
-                    else:
-                        if image_category not in image2category[image_path]:
-                            image2category[image_path].append(image_category)
-
-
-        return category2image, image2category
+        # parsing the scene files is slow, the index is cached in resources/CLEVR_v1.0/ (see clevr_index.py)
+        return clevr_index.load_index(os.path.join('resources', 'CLEVR_v1.0')).to_dicts()
 
     def select_random_item(self, images:list):
         random_index = random.randint(0, len(images)-1)
@@ -206,21 +175,21 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
 
             target_category_images = aed_dataset[target_category]
             target_image = self.select_random_item(target_category_images)
-            shutil.copyfile(target_image, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(target_image, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
             target_image_path = os.path.join("games", "multimodal_referencegame", "resources", "scene_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the target image from the list, select another image from the same category
             target_category_images.remove(target_image)
             distractor1 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor1, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor1, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
             distractor1_path = os.path.join("games", "multimodal_referencegame", "resources", "scene_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the target image from the list, select another image from the same category
             target_category_images.remove(distractor1)
             distractor2 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor2, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor2, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
             distractor2_path = os.path.join("games", "multimodal_referencegame", "resources", "scene_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
@@ -332,21 +301,21 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
             if target_image_path == '':
                 target_category_images = aed_dataset[target_category]
                 target_image = self.select_random_item(target_category_images)
-                shutil.copyfile(target_image, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
+                image_store.link_image(target_image, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
                 target_image_path = os.path.join("games", "multimodal_referencegame", "resources", "scene_images", f"{str(image_counter)}.jpg")
                 image_counter += 1
                 # remove the target image from the list, select another image from the same category
                 target_category_images.remove(target_image)
 
             distractor1 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor1, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor1, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
             distractor1_path = os.path.join("games", "multimodal_referencegame", "resources", "scene_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the target image from the list, select another image from the same category
             target_category_images.remove(distractor1)
             distractor2 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor2, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor2, os.path.join("resources", "scene_images", f"{str(image_counter)}.jpg"))
             distractor2_path = os.path.join("games", "multimodal_referencegame", "resources", "scene_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
@@ -449,21 +418,21 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
 
             target_category_images = docci_dataset[target_category]
             target_image = self.select_random_item(target_category_images)
-            shutil.copyfile(target_image, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(target_image, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
             target_image_path = os.path.join("games", "multimodal_referencegame", "resources", "docci_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the target image from the list, select another image from the same category
             target_category_images.remove(target_image)
             distractor1 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor1, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor1, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
             distractor1_path = os.path.join("games", "multimodal_referencegame", "resources", "docci_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the distractor1 image from the list, select another image from the same category
             target_category_images.remove(distractor1)
             distractor2 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor2, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor2, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
             distractor2_path = os.path.join("games", "multimodal_referencegame", "resources", "docci_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
@@ -579,7 +548,7 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
         if target_image_path == '':
             target_category_images = docci_dataset[target_category]
             target_image = self.select_random_item(target_category_images)
-            shutil.copyfile(target_image, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(target_image, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
             target_image_path = os.path.join("games", "multimodal_referencegame", "resources", "docci_images", f"{str(image_counter)}.jpg")
             image_counter += 1
             target_category_images.remove(target_image)
@@ -587,14 +556,14 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
         while True:
 
             distractor1 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor1, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor1, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
             distractor1_path = os.path.join("games", "multimodal_referencegame", "resources", "docci_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the distractor1 image from the list, select another image from the same category
             target_category_images.remove(distractor1)
             distractor2 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor2, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor2, os.path.join("resources", "docci_images", f"{str(image_counter)}.jpg"))
             distractor2_path = os.path.join("games", "multimodal_referencegame", "resources", "docci_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
@@ -684,33 +653,12 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
             if game_counter >= MAX_NUMBER_INSTANCES:
                 break
 
-    def select_distractor_for_clevr(self, target_categories, category2image, image2category):
-        # get the categories of the selected image as target
-        # target_categories = image2category[target_image]
-
-        # loop over each category of the target image and find the image that has the most common categories with the target image
-        distractor1 = ""
-        max_common_categories = 0
-
-        for category in target_categories:
-            for image in category2image[category]:
-
-                if image not in image2category:
-                    continue
-
-                common_categories = set(target_categories).intersection(image2category[image])
-                num_common_categories = len(common_categories)
-                if num_common_categories > max_common_categories:
-                    distractor1 = image
-                    max_common_categories = num_common_categories
-
-        return distractor1
-
     def generate_clevr_instances(self):
         player_a_prompt_header = self.load_template(os.path.join("resources", "initial_prompts", "player_a_prompt_images.template"))
         player_b_prompt_header = self.load_template(os.path.join("resources", "initial_prompts", "player_b_prompt_images.template"))
 
         category2image, image2category = self.get_clevr_dataset()
+        distractors = clevr_index.DistractorSearch(category2image, image2category)
 
         game_counter = 0
         image_counter = 1
@@ -721,34 +669,34 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
             target_image = self.select_random_item(target_category_images)
 
             target_categories = image2category[target_image]
-            image2category.pop(target_image)
+            distractors.pop_image(target_image)
 
 
 
-            distractor1 = self.select_distractor_for_clevr(target_categories, category2image, image2category)
+            distractor1 = distractors.select(target_categories)
 
-            image2category.pop(distractor1)
+            distractors.pop_image(distractor1)
 
 
-            distractor2 = self.select_distractor_for_clevr(target_categories, category2image, image2category)
-            image2category.pop(distractor2)
+            distractor2 = distractors.select(target_categories)
+            distractors.pop_image(distractor2)
 
 
-            shutil.copyfile(target_image, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(target_image, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
             target_image_path = os.path.join("games", "multimodal_referencegame", "resources", "clevr_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the target image from the list, select another image from the same category
-            target_category_images.remove(target_image)
+            distractors.remove_from_category(target_image, target_category)
             distractor1 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor1, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor1, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
             distractor1_path = os.path.join("games", "multimodal_referencegame", "resources", "clevr_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
             # remove the distractor1 image from the list, select another image from the same category
-            target_category_images.remove(distractor1)
+            distractors.remove_from_category(distractor1, target_category)
             distractor2 = self.select_random_item(target_category_images)
-            shutil.copyfile(distractor2, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor2, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
             distractor2_path = os.path.join("games", "multimodal_referencegame", "resources", "clevr_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
@@ -853,35 +801,34 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
                 image_counter = len(files) + 1
 
         category2image, image2category = self.get_clevr_dataset()
+        distractors = clevr_index.DistractorSearch(category2image, image2category)
 
         experiment = self.add_experiment('CLEVR_static_target_images')
 
         target_image = ''
-        target_categories = []
+        ranked = []
 
         for target_category in category2image:
 
             if target_image == '':
                 target_category_images = category2image[target_category]
                 target_image = self.select_random_item(target_category_images)
-                target_categories = image2category[target_image]
-                image2category.pop(target_image)
+                distractors.pop_image(target_image)
+                # the target stays the same, so all distractors are ranked at once (two per category)
+                ranked = distractors.nearest([target_image], k=2 * len(category2image))[0]
 
-                shutil.copyfile(target_image, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
+                image_store.link_image(target_image, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
                 target_image_path = os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg")
                 image_counter += 1
 
-            distractor1 = self.select_distractor_for_clevr(target_categories, category2image, image2category)
-            image2category.pop(distractor1)
-
-            distractor2 = self.select_distractor_for_clevr(target_categories, category2image, image2category)
-            image2category.pop(distractor2)
+            distractor1, distractor2 = ranked[:2]
+            ranked = ranked[2:]
 
-            shutil.copyfile(distractor1, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor1, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
             distractor1_path = os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
-            shutil.copyfile(distractor2, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
+            image_store.link_image(distractor2, os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg"))
             distractor2_path = os.path.join("resources", "clevr_images", f"{str(image_counter)}.jpg")
             image_counter += 1
 
@@ -1,22 +1,50 @@
 import random
+import re
+from functools import lru_cache
 from typing import Dict, List
 
 from clemcore.clemgame import Player
 
 
+@lru_cache(maxsize=None)
+def compile_pattern(pattern: str, flags: int = 0):
+    """
+    Compile a response pattern once per process (patterns repeat across all instances of an experiment)
+    :param pattern: regex string from the game instance
+    :param flags: re flags
+    :return: compiled pattern
+    """
+    return re.compile(pattern, flags)
+
+
 class Instruction:
 
     def __init__(self):
         self.user_messages = []
         self.system_messages = []
+        # the query messages are extended with every added message (None if they have to be rebuilt)
+        self.query_messages = [{"role": "system", "content": ""}]
+        # immutable snapshot of the query messages taken since the last added message
+        self.query_snapshot = None
 
     def add_user_message(self, message):
+        if self.query_messages is not None and len(self.system_messages) == len(self.user_messages):
+            self.query_messages.append({"role": "user", "content": message})
+        else:
+            # the messages don't alternate, the new one doesn't go to the end
+            self.query_messages = None
         self.user_messages.append(message)
+        self.query_snapshot = None
 
     def add_system_message(self, message):
+        if self.query_messages is not None and len(self.system_messages) == len(self.user_messages) - 1:
+            self.query_messages.append({"role": "assistant", "content": message})
+        else:
+            self.query_messages = None
         self.system_messages.append(message)
+        self.query_snapshot = None
 
-    def convert_to_query_messages(self):
+    def build_query_messages(self):
         messages = []
         messages.append({"role": "system", "content": ""})
         for i in range(0, len(self.user_messages)):
@@ -27,6 +55,27 @@ class Instruction:
 
         return messages
 
+    def current_query_messages(self):
+        if self.query_messages is None:
+            self.query_messages = self.build_query_messages()
+        return self.query_messages
+
+    def convert_to_query_messages(self):
+        """
+        The messages to query a model with, as a new list that backends may change
+        (a copy of the message references, the message dicts are shared)
+        """
+        return list(self.current_query_messages())
+
+    def snapshot(self):
+        """
+        The query messages as an immutable tuple that doesn't change when messages are
+        added later, e.g. to log or identify a prompt. Taken at most once per added message.
+        """
+        if self.query_snapshot is None:
+            self.query_snapshot = tuple(self.current_query_messages())
+        return self.query_snapshot
+
     def serialize(self):
         output = []
 
@@ -86,6 +135,8 @@ class ReferenceGame:
 
         self.player_1_response_pattern = r'{}'.format(game_instance['player_1_response_pattern'])
         self.player_2_response_pattern = r'{}'.format(game_instance['player_2_response_pattern'])
+        self.player_1_response_regex = compile_pattern(self.player_1_response_pattern, re.IGNORECASE)
+        self.player_2_response_regex = compile_pattern(self.player_2_response_pattern, re.IGNORECASE)
 
         self.player_1_target_grid = game_instance['player_1_target_grid']
         self.player_1_second_grid = game_instance['player_1_second_grid']
@@ -11,11 +11,14 @@ Creates instances_{version}_{lang}.json in in/
 import logging
 import os
 import json
-import Levenshtein # to calculate distance between grids
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 from clemcore.clemgame import GameInstanceGenerator
 
 from resources.localization_utils import MULTILINGUAL_PATTERNS
+from resources.grid_pools import GridIndex, encode_grids, hamming_distances
 
 logger = logging.getLogger(__name__)
 
@@ -36,69 +39,83 @@ def generate_samples(grids):
     :param grids: list of string grid representations
     :return: list of triplets where the first is the target and the following two are distractors
     """
+    # select distractors with smallest distance (number of differing cells)
+    distractors, _ = GridIndex(encode_grids(grids)).nearest(k=2)
     samples = []
-    # calculate edit distance between grids
-    edit_distances = get_distances(grids)
-    # select distractors with smallest edit distance
-    for target_grid_id in range(len(grids)):
-        second_grid_id, third_grid_id = select_distractors(target_grid_id, edit_distances)
+    for target_grid_id, (second_grid_id, third_grid_id) in enumerate(distractors):
         samples.append((grids[target_grid_id], grids[second_grid_id], grids[third_grid_id]))
     return samples
 
 
 def get_distances(grids):
     """
-    Calculate edit distances to select similar distractors
+    Calculate distances to select similar distractors
     :param grids: list of string grid representations
-    :return: matrix of edit distances with ids corresponding to grids (the full matrix is filled for easier access to distances per grid)
+    :return: matrix of distances with ids corresponding to grids (the full matrix is filled for easier access to distances per grid)
     """
-    distances = []
-    for i in range(len(grids)):
-        i_distances = []
-        for j in range(len(grids)):
-            if i == j:
-                i_distances.append(0)
-            else:
-                i_distances.append(Levenshtein.distance(grids[i], grids[j]))
-        distances.append(i_distances)
-    return distances
-
-
-def select_distractors(target_grid: int, distances: list):
+    return hamming_distances(encode_grids(grids), np.arange(len(grids)))
+
+
+@lru_cache(maxsize=None)
+def plan_instances(grid_file):
+    """
+    Plan the instances of all grid groups independently of the language
+    (computed once per process and grid file)
+    :param grid_file: .json file containing the grids
+    :return: dict of grid group -> list of instance plans, each with the grids in the order
+             of player 1 (target first), in the order of player 2 and the position of the target for player 2
+    """
+    with open(grid_file, 'r') as f:
+        grids = json.load(f)
+
+    plan = {}
+    for grids_group in grids.keys():
+        instance_plans = []
+        # get triplets
+        for target_grid, second_grid, third_grid in generate_samples(grids[grids_group]):
+            # create three instances from each triplet, where the target for player 2 is in
+            # one of the three possible positions each (selecting one order for the other two)
+            player_2_orders = {
+                # keep order from player 1 for second and third grid
+                1: (target_grid, second_grid, third_grid),
+                # third grid stays third grid
+                2: (second_grid, target_grid, third_grid),
+                # second grid stays second grid
+                3: (third_grid, second_grid, target_grid)
+            }
+            for position, player_2_grids in player_2_orders.items():
+                instance_plans.append({
+                    "player_1_grids": (target_grid, second_grid, third_grid),
+                    "player_2_grids": player_2_grids,
+                    "target_position": position
+                })
+        plan[grids_group] = instance_plans
+    return plan
+
+
+def generate_language(lang, plan):
+    """
+    Render the plan into instances_{version}_{lang}.json
+    :param lang: language identifier string
+    :param plan: triplet plan from plan_instances
+    :return: language identifier string
+    """
+    ReferenceGameInstanceGenerator().generate(filename=f"instances_{VERSION}_{lang}.json", lang=lang, plan=plan)
+    return lang
+
+
+def generate_all_languages(languages=None, workers=None):
     """
-    Select two most similar distractors for the given target
-    :param target_grid: id of the target grid in corresponding distance matrix
-    :param distances: matrix of distances between grid ids
-    :return: ids of two distractor grids
+    Plan the instances once and render every language in its own worker process
+    :param languages: language identifier strings, all in MULTILINGUAL_PATTERNS if None
+    :param workers: number of worker processes (default: number of CPUs)
+    :return: list of the generated languages
     """
-    id1 = None
-    id2 = None
-    min_distance = 1
-    distance_list = distances[target_grid]
-    found1 = False
-    found2 = False
-    while not found2:
-        # iterate through list of distances,
-        # increasing the distance with every iteration
-        # to find the two lowest distances and return their ids
-        if min_distance in distance_list:
-            if not found1:
-                # save id of lowest distance
-                id1 = distance_list.index(min_distance)
-                found1 = True
-            elif id1 != distance_list.index(min_distance):
-                # save id of next lowest distance if id1 is already found
-                id2 = distance_list.index(min_distance)
-                found2 = True
-            elif min_distance in distance_list[id1 + 1:]:
-                # or save next id of same lowest distance as id1 if it exists
-                id2 = distance_list.index(min_distance, id1 + 1)
-                found2 = True
-            else:
-                min_distance += 1
-        else:
-            min_distance += 1
-    return id1, id2
+    if languages is None:
+        languages = list(MULTILINGUAL_PATTERNS.keys())
+    plan = plan_instances(GRIDS)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(generate_language, languages, [plan] * len(languages)))
 
 
 class ReferenceGameInstanceGenerator(GameInstanceGenerator):
@@ -107,80 +124,57 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
         super().__init__(os.path.dirname(__file__))
         self.lang = None
 
-    def on_generate(self, lang):
+    def on_generate(self, lang, plan=None):
         """
         Create instances into self.instances
         (Called by super().generate())
+        :param lang: language identifier string
+        :param plan: triplet plan from plan_instances, computed here if not given
         """
         self.lang = lang
-
-        # load grids
-        with open(GRIDS, 'r') as f:
-            grids = json.load(f)
+        if plan is None:
+            plan = plan_instances(GRIDS)
+
+        # everything language specific is loaded once for all grid groups
+        player_a_prompt_header = self._load_prompt("player_a_prompt_header.template")
+        player_b_prompt_header = self._load_prompt("player_b_prompt_header.template")
+        # extract target grid names from localization_utils
+        targets = MULTILINGUAL_PATTERNS[self.lang]["p2_options"].split("|")
+        assert len(targets) == 3
+        player_1_response_pattern = self._generate_regex("p1")
+        player_2_response_pattern = self._generate_regex("p2")
 
         # generate sub experiments
-        for grids_group in grids.keys():
-            # get triplets
-            samples = generate_samples(grids[grids_group])
-
-            player_a_prompt_header = self._load_prompt("player_a_prompt_header.template")
-            player_b_prompt_header = self._load_prompt("player_b_prompt_header.template")
-
+        for grids_group, instance_plans in plan.items():
             experiment = self.add_experiment(f"{grids_group}")
 
-            game_counter = 0
-            for sample in samples:
-                # create three instances from each triplet, where the target for player 2 is in
-                # one of the three possible positions each (selecting one order for the other two)
-                for i in [1, 2, 3]:
-                    target_grid, second_grid, third_grid = sample
-
-                    game_instance = self.add_game_instance(experiment, game_counter)
-                    game_instance["player_1_prompt_header"] = player_a_prompt_header.replace('TARGET_GRID', target_grid)\
-                                                                                    .replace('SECOND_GRID', second_grid)\
-                                                                                    .replace('THIRD_GRID', third_grid)
-                    game_instance['player_1_target_grid'] = target_grid
-                    game_instance['player_1_second_grid'] = second_grid
-                    game_instance['player_1_third_grid'] = third_grid
-
-                    # create order of grids for player 2
-                    # extract target grid names from localization_utils
-                    targets = MULTILINGUAL_PATTERNS[self.lang]["p2_options"].split("|")
-                    assert len(targets) == 3
-
-                    first_grid = ""
-                    target_grid_name = []
-                    if i == 1:
-                        first_grid = target_grid
-                        # keep order from player 1 for second and third grid
-                        target_grid_name = [targets[0], "1"] # corresponds to "first"
-                    elif i == 2:
-                        first_grid = second_grid
-                        second_grid = target_grid
-                        # third grid stays third grid
-                        target_grid_name = [targets[1], "2"] # corresponds to "second"
-                    elif i == 3:
-                        first_grid = third_grid
-                        # second grid stays second grid
-                        third_grid = target_grid
-                        target_grid_name = [targets[2], "3"] # corresponds to "third"
-
-                    game_instance["player_2_prompt_header"] = player_b_prompt_header.replace('FIRST_GRID', first_grid)\
-                                                                                    .replace('SECOND_GRID', second_grid)\
-                                                                                    .replace('THIRD_GRID', third_grid)
-                    game_instance['player_2_first_grid'] = first_grid
-                    game_instance['player_2_second_grid'] = second_grid
-                    game_instance['player_2_third_grid'] = third_grid
-                    game_instance['target_grid_name'] = target_grid_name
-
-                    game_instance['player_1_response_pattern'] = self._generate_regex("p1")
-                    game_instance['player_2_response_pattern'] = self._generate_regex("p2")
-
-                    game_instance['lang'] = self.lang
-                    game_instance['p1_mode'] = P1_MODE
-                    game_instance['p2_mode'] = P2_MODE
-
-                    game_counter += 1
+            for game_counter, instance_plan in enumerate(instance_plans):
+                target_grid, second_grid, third_grid = instance_plan["player_1_grids"]
+                game_instance = self.add_game_instance(experiment, game_counter)
+                game_instance["player_1_prompt_header"] = player_a_prompt_header.replace('TARGET_GRID', target_grid)\
+                                                                                .replace('SECOND_GRID', second_grid)\
+                                                                                .replace('THIRD_GRID', third_grid)
+                game_instance['player_1_target_grid'] = target_grid
+                game_instance['player_1_second_grid'] = second_grid
+                game_instance['player_1_third_grid'] = third_grid
+
+                first_grid, second_grid, third_grid = instance_plan["player_2_grids"]
+                position = instance_plan["target_position"]
+                game_instance["player_2_prompt_header"] = player_b_prompt_header.replace('FIRST_GRID', first_grid)\
+                                                                                .replace('SECOND_GRID', second_grid)\
+                                                                                .replace('THIRD_GRID', third_grid)
+                game_instance['player_2_first_grid'] = first_grid
+                game_instance['player_2_second_grid'] = second_grid
+                game_instance['player_2_third_grid'] = third_grid
+                # e.g. ["first", "1"]
+                game_instance['target_grid_name'] = [targets[position - 1], str(position)]
+
+                game_instance['player_1_response_pattern'] = player_1_response_pattern
+                game_instance['player_2_response_pattern'] = player_2_response_pattern
+
+                game_instance['lang'] = self.lang
+                game_instance['p1_mode'] = P1_MODE
+                game_instance['p2_mode'] = P2_MODE
 
     def _load_prompt(self, template):
         """
@@ -228,6 +222,4 @@ class ReferenceGameInstanceGenerator(GameInstanceGenerator):
 
 if __name__ == '__main__':
     # generate language versions
-    for language in MULTILINGUAL_PATTERNS.keys():
-        ReferenceGameInstanceGenerator().generate(
-            filename=f"instances_{VERSION}_{language}.json", lang=language)
+    generate_all_languages()
@@ -3,16 +3,34 @@ from typing import List, Dict
 import numpy as np
 import logging
 import os
+import json
+from collections import OrderedDict
 
 from clemcore.backends import Model
 from clemcore.clemgame import file_utils, GameSpec
 from clemcore.clemgame import metrics
 from clemcore.clemgame import GameMaster, GameBenchmark, GameScorer
 from game import ReferenceGame
-import re
 
 logger = logging.getLogger(__name__)
 
+# the three instances of a triplet send the same message to Player 1; with deterministic
+# decoding its response can be requested once and replayed for the other two
+MEMOIZE_PLAYER_1 = False
+# number of Player 1 responses kept for replay
+MEMO_SIZE = 1024
+_player_1_responses = OrderedDict()
+
+
+def response_key(model: Model, messages: List[Dict]):
+    """
+    Identify a request to a model
+    :param model: the model of the player
+    :param messages: the exact message list sent to the model
+    :return: hashable key of model name, temperature and messages
+    """
+    return model.get_name(), model.get_temperature(), json.dumps(messages, ensure_ascii=False)
+
 
 class ReferenceGameMaster(GameMaster):
 
@@ -46,17 +64,31 @@ class ReferenceGameMaster(GameMaster):
         action = {'type': 'send message', 'content': self.game.given_instruction.user_messages[-1]}
         self.log_event(from_="GM", to="Player 1", action=action)
 
-        player_1_prompt, player_1_response, player_1_response_text = self.game.instruction_giver(
-            self.game.given_instruction, None)
+        key = None
+        if MEMOIZE_PLAYER_1:
+            key = response_key(self.player_models[0], self.game.given_instruction.snapshot())
+        reused = key in _player_1_responses
+        if reused:
+            player_1_prompt, player_1_response, player_1_response_text = _player_1_responses[key]
+            _player_1_responses.move_to_end(key)
+        else:
+            player_1_prompt, player_1_response, player_1_response_text = self.game.instruction_giver(
+                self.game.given_instruction, None)
+            if key is not None:
+                _player_1_responses[key] = (player_1_prompt, player_1_response, player_1_response_text)
+                if len(_player_1_responses) > MEMO_SIZE:
+                    _player_1_responses.popitem(last=False)
 
         # log the retrieved utterance
         action = {'type': 'get message', 'content': player_1_response_text}
+        if reused:
+            # the response of an earlier, identical request was replayed
+            action['reused'] = True
         self.log_event(from_="Player 1", to="GM", action=action, call=(player_1_prompt, player_1_response))
 
         self.game.given_instruction.add_system_message(player_1_response_text)
 
-        player_1_pattern = re.compile(self.game.player_1_response_pattern, re.IGNORECASE)
-        p1_match = re.match(player_1_pattern, player_1_response_text)
+        p1_match = self.game.player_1_response_regex.match(player_1_response_text)
         match = False
         if p1_match:
             if self.game.p1_mode == "liberal" or (self.game.p1_mode == "strict" and p1_match.group('remainder') == ""):
@@ -96,8 +128,7 @@ class ReferenceGameMaster(GameMaster):
         self.log_event(from_="Player 2", to="GM", action=action, call=(player_2_prompt, player_2_response))
 
         # check if the Player 2 message matches the rule => start with the right tag and generate only the label
-        player_2_pattern = re.compile(self.game.player_2_response_pattern, re.IGNORECASE)
-        p2_match = re.match(player_2_pattern, player_2_response_text)
+        p2_match = self.game.player_2_response_regex.match(player_2_response_text)
         match = False
         if p2_match:
             if self.game.p2_mode == "liberal" or (self.game.p2_mode == "strict" and p2_match.group('remainder') == ""):
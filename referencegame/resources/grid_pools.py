@@ -0,0 +1,244 @@
+"""
+Procedural grid pools for referencegame
+
+Grids are stored as bitboards: one uint32 per 5x5 grid, bit i is set if cell i
+(row-major) is filled. Pools can be far larger than the hand-built categories of
+create_grids.py, e.g. all row or column combinations or random grids with a
+given fill density. GridIndex finds the most similar (hardest) distractors for
+many targets at once, by popcounts over the whole pool or, for large pools, by
+looking up all grids within a small number of differing cells.
+
+Create a pool file (run from resources/):
+python3 grid_pools.py grid_pool.npz --random 100000 --density 0.4
+"""
+import json
+from functools import lru_cache
+from itertools import combinations
+import numpy as np
+
+SIZE = 5
+N_CELLS = SIZE * SIZE
+FILLED_CELL = "X"
+EMPTY_CELL = "▢"
+# number of set bits of every byte
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+# number of targets whose distances to the whole pool are computed at once
+QUERY_BLOCK = 1024
+# pools of this size and larger are searched by looking up the grids around a target
+BALL_SEARCH_POOL = 4096
+# largest number of differing cells looked up before comparing with the whole pool
+BALL_RADIUS = 3
+
+ROW_MASK = (1 << SIZE) - 1
+COLUMN_MASK = sum(1 << (row * SIZE) for row in range(SIZE))
+
+
+def encode_grids(grids):
+    """
+    Pack grids into bitboards
+    :param grids: list of string grid representations (cells separated by whitespace)
+    :return: array with one uint32 per grid, bit i is set if cell i is filled
+    """
+    cells = np.array([[cell == FILLED_CELL for cell in grid.split()] for grid in grids], dtype=np.uint32)
+    assert cells.shape[1] <= 32, "grids with more than 32 cells don't fit into a uint32"
+    return (cells << np.arange(cells.shape[1], dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+
+
+def decode_grid(code):
+    """
+    Unpack a bitboard
+    :param code: bitboard of a 5x5 grid
+    :return: string grid representation, as in the grid files
+    """
+    code = int(code)
+    rows = []
+    for row in range(SIZE):
+        cells = [FILLED_CELL if code >> (row * SIZE + column) & 1 else EMPTY_CELL for column in range(SIZE)]
+        rows.append(" ".join(cells))
+    return "\n".join(rows)
+
+
+def popcount(codes):
+    """
+    Count the set bits of bitboards
+    :param codes: uint32 array
+    :return: int64 array of the same shape
+    """
+    codes = np.ascontiguousarray(codes, dtype=np.uint32)
+    if hasattr(np, "bitwise_count"):
+        # numpy >= 2.0
+        return np.bitwise_count(codes).astype(np.int64)
+    return POPCOUNT[codes.view(np.uint8)].reshape(*codes.shape, 4).sum(axis=-1, dtype=np.int64)
+
+
+@lru_cache(maxsize=None)
+def ball_masks(radius):
+    """ all bitboards with radius filled cells, XOR with a grid gives the grids at that distance """
+    return np.array([sum(1 << cell for cell in cells) for cells in combinations(range(N_CELLS), radius)],
+                    dtype=np.uint32)
+
+
+def hamming_distances(codes, targets):
+    """
+    Count the cells in which grids differ
+    :param codes: bitboards of the pool
+    :param targets: ids of the grids to compare with the whole pool
+    :return: matrix of distances, one row per target and one column per grid
+    """
+    codes = np.asarray(codes, dtype=np.uint32)
+    return popcount(codes[np.asarray(targets), None] ^ codes[None, :])
+
+
+def line_grids(mask):
+    """ all grids made of full lines (mask is one line at position 0), from 1 to 4 lines """
+    step = 1 if mask == COLUMN_MASK else SIZE
+    codes = []
+    for lines in range(1, (1 << SIZE) - 1):
+        codes.append(sum(mask << (line * step) for line in range(SIZE) if lines >> line & 1))
+    return np.array(codes, dtype=np.uint32)
+
+
+def row_grids():
+    """ all combinations of filled rows (neither empty nor full grids) """
+    return line_grids(ROW_MASK)
+
+
+def column_grids():
+    """ all combinations of filled columns (neither empty nor full grids) """
+    return line_grids(COLUMN_MASK)
+
+
+def random_grids(num_grids, density, seed=123, unique=True):
+    """
+    Create random grids
+    :param num_grids: number of grids to create
+    :param density: probability of a cell to be filled
+    :param seed: seed of the random generator
+    :param unique: leave out repeated grids (keeping the order in which they were drawn),
+                   so the pool can be smaller than num_grids
+    :return: bitboards of the random grids
+    """
+    rng = np.random.default_rng(seed)
+    cells = rng.random((num_grids, N_CELLS)) < density
+    codes = (cells.astype(np.uint32) << np.arange(N_CELLS, dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+    if unique:
+        _, first = np.unique(codes, return_index=True)
+        codes = codes[np.sort(first)]
+    return codes
+
+
+class GridIndex:
+    """
+    Nearest neighbour search over a pool of bitboards. In small pools, distances to
+    the whole pool are XOR popcounts, computed for blocks of targets at once. In large
+    pools, all grids that differ from a target in 1, 2, ... BALL_RADIUS cells are
+    looked up in the sorted pool instead (falling back to the popcounts if there are
+    not enough of them). Grids identical to a target are never returned and ties go
+    to the lower id, so both searches give the same, deterministic results.
+    """
+
+    def __init__(self, codes):
+        self.codes = np.ascontiguousarray(codes, dtype=np.uint32)
+        # the pool sorted by bitboard (and by id for repeated grids) for the lookups
+        self.order = np.argsort(self.codes, kind="stable")
+        self.sorted_codes = self.codes[self.order]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def nearest(self, targets=None, k=2):
+        """
+        Find the k hardest distractors of every target
+        :param targets: ids of the targets in the pool, all grids if None
+        :param k: number of distractors per target
+        :return: ids (targets x k) and distances (targets x k) of the distractors, closest first
+        """
+        if targets is None:
+            targets = np.arange(len(self.codes))
+        targets = np.atleast_1d(np.asarray(targets))
+        ids = np.empty((len(targets), k), dtype=np.int64)
+        distances = np.empty((len(targets), k), dtype=np.int64)
+        if len(self.codes) >= BALL_SEARCH_POOL:
+            for row, target in enumerate(targets):
+                ids[row], distances[row] = self._nearest_ball(target, k)
+            return ids, distances
+        for start in range(0, len(targets), QUERY_BLOCK):
+            block = slice(start, start + QUERY_BLOCK)
+            ids[block], distances[block] = self._nearest_block(targets[block], k)
+        return ids, distances
+
+    def _nearest_block(self, targets, k):
+        distances = hamming_distances(self.codes, targets)
+        n_grids = distances.shape[1]
+        # unique keys ordered by distance first and id second
+        keys = distances * n_grids + np.arange(n_grids)
+        keys[distances == 0] = np.iinfo(keys.dtype).max
+        closest = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        closest = np.take_along_axis(closest, np.argsort(np.take_along_axis(keys, closest, axis=1), axis=1), axis=1)
+        return closest, np.take_along_axis(distances, closest, axis=1)
+
+    def _nearest_ball(self, target, k):
+        found_ids = []
+        found_distances = []
+        code = self.codes[target]
+        for radius in range(1, BALL_RADIUS + 1):
+            candidates = code ^ ball_masks(radius)
+            starts = np.searchsorted(self.sorted_codes, candidates, side="left")
+            ends = np.searchsorted(self.sorted_codes, candidates, side="right")
+            hits = starts < ends
+            if hits.any():
+                # all grids at this distance, ties go to the lower id
+                at_radius = np.sort(np.concatenate([self.order[a:b] for a, b in zip(starts[hits], ends[hits])]))
+                found_ids.extend(at_radius[:k - len(found_ids)])
+                found_distances.extend([radius] * min(len(at_radius), k - len(found_distances)))
+            if len(found_ids) == k:
+                return found_ids, found_distances
+        # not enough similar grids around the target, compare with the whole pool
+        closest, distances = self._nearest_block(np.array([target]), k)
+        return closest[0], distances[0]
+
+
+def difficulty_levels(distances, edges):
+    """
+    Grade targets by how close their distractors are
+    :param distances: distractor distances per target (see GridIndex.nearest)
+    :param edges: increasing summed distances that separate the levels
+    :return: level per target, 0 is the hardest (distractors closest to the target)
+    """
+    return np.digitize(np.asarray(distances).sum(axis=1), edges)
+
+
+def save_pools(path, pools):
+    """ stores the pools (name -> bitboards) in one compressed numpy file """
+    np.savez_compressed(path, **{name: np.asarray(codes, dtype=np.uint32) for name, codes in pools.items()})
+
+
+def load_pools(path):
+    """ loads pools stored with save_pools """
+    with np.load(path) as stored:
+        return {name: stored[name] for name in stored.files}
+
+
+def grid_file_pools(grid_file):
+    """ loads a json grid file (e.g. grids_v1.5.json) as bitboard pools """
+    with open(grid_file, 'r') as f:
+        grid_dict = json.load(f)
+    return {name: encode_grids(grids) for name, grids in grid_dict.items()}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Create procedural grid pools for referencegame.")
+    parser.add_argument("outfile")
+    parser.add_argument("--random", type=int, default=10000, help="number of random grids to draw")
+    parser.add_argument("--density", type=float, default=0.4, help="probability of a cell to be filled")
+    parser.add_argument("--seed", type=int, default=123)
+    args = parser.parse_args()
+    pools = {
+        "line_grids_rows": row_grids(),
+        "line_grids_columns": column_grids(),
+        "random_grids": random_grids(args.random, args.density, args.seed)
+    }
+    save_pools(args.outfile, pools)
+    for name, codes in pools.items():
+        print(f"{name}: {len(codes)} grids")
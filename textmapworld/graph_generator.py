@@ -5,6 +5,8 @@ import matplotlib.pyplot as plt
 import time
 import networkx as nx
 import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
 class SaveGraphInfo:
 
@@ -308,41 +310,12 @@ class GraphGenerator:
                     return mapping
             
 
-        def save_graph_picture(graph):
+        if self.graph_type=="named_graph":
+            self.node_label_mapping = assign_types(self.ambiguity, self.G.copy())
 
-            picture_number = random.randint(0, 10000)
-            picture_name = "graph_" + str(picture_number) + ".png"
-            # get the current working directory
-            current_working_directory = os.path.join("..", "clemgames", "textmapworld", self.game_name, "resources", "images")
-            file_exists = exists(os.path.join(current_working_directory, picture_name))
-            
-            if file_exists:
-                picture_name = "graph_" + str(picture_number + 1) + ".png"
-
-            if  self.graph_type=="unnamed_graph":
-                nx.draw_networkx(graph, pos={n: n for n in graph.nodes()})
-                # Display the graph
-            elif self.graph_type=="named_graph":
-                G_copy = self.G.copy()
-                # Assign node labels using your function
-                self.node_label_mapping = assign_types(self.ambiguity, G_copy)
-                # Set node attributes
-                nx.set_node_attributes(G_copy, self.node_label_mapping, 'label')
-                # Get the 'label' attribute for each node
-                labels = nx.get_node_attributes(G_copy, 'label')
-                # Draw the graph with labels
-                nx.draw_networkx(G_copy, pos={n: n for n in G_copy.nodes()}, labels=labels, with_labels=True)
-
-            # Display the graph
-            plt.savefig(current_working_directory + picture_name)
-            plt.clf()
-
-            return picture_name
-
-        picture_name = save_graph_picture(self.G)
         graph_directions = SaveGraphInfo.get_node_directions(list(self.G.nodes()), paths)
         moves_nodes_list = SaveGraphInfo.get_moves_nodes_list(self.G, graph_directions)
-        graph_dict={"Picture_Name":picture_name, "Graph_Type": self.graph_type, "Grid_Dimension": str(self.n), "Graph_Nodes":list(self.G.nodes()), "Graph_Edges": list(self.G.edges()), "N_edges": len(list(self.G.edges())) , "Initial_Position": self.random_room, "Directions": graph_directions, "Moves": moves_nodes_list ,"Cycle":self.cycle, 'Ambiguity': self.ambiguity}
+        graph_dict={"Picture_Name":None, "Graph_Type": self.graph_type, "Grid_Dimension": str(self.n), "Graph_Nodes":list(self.G.nodes()), "Graph_Edges": list(self.G.edges()), "N_edges": len(list(self.G.edges())) , "Initial_Position": self.random_room, "Directions": graph_directions, "Moves": moves_nodes_list ,"Cycle":self.cycle, 'Ambiguity': self.ambiguity}
         
         if self.graph_type=="named_graph":
 
@@ -384,5 +357,60 @@ class GraphGenerator:
                     each_move.append((movement[0], change))
                     renamed_moves_nodes_list.append({"node": renamed_node, "node_moves":each_move})
             
-            graph_dict= {"Picture_Name":picture_name, "Graph_Type": self.graph_type, "Grid_Dimension": str(self.n), "Graph_Nodes":renamed_nodes, "Graph_Edges":renamed_edges , "N_edges": len(list(self.G.edges())) , "Initial_Position": self.random_room, "Directions": renamed_graph_directions , "Moves": renamed_moves_nodes_list ,"Cycle":self.cycle, 'Ambiguity': self.ambiguity, "Mapping": self.node_label_mapping}
+            graph_dict= {"Picture_Name":None, "Graph_Type": self.graph_type, "Grid_Dimension": str(self.n), "Graph_Nodes":renamed_nodes, "Graph_Edges":renamed_edges , "N_edges": len(list(self.G.edges())) , "Initial_Position": self.random_room, "Directions": renamed_graph_directions , "Moves": renamed_moves_nodes_list ,"Cycle":self.cycle, 'Ambiguity': self.ambiguity, "Mapping": self.node_label_mapping}
+        # the picture itself is rendered in a separate stage, see render_graph_pictures
+        graph_dict["Picture_Name"] = graph_picture_name(graph_dict)
         return  graph_dict
+
+
+
+def graph_picture_name(graph_dict):
+    "Names the picture after a hash of the graph, so that the same graph is only rendered once"
+    graph_key = [graph_dict["Graph_Type"], sorted(map(str, graph_dict["Graph_Nodes"])), sorted(map(str, graph_dict["Graph_Edges"]))]
+    if graph_dict["Graph_Type"] == "named_graph":
+        graph_key.append(sorted(map(str, graph_dict["Mapping"].items())))
+    graph_hash = hashlib.sha1(str(graph_key).encode()).hexdigest()[:16]
+    return "graph_" + graph_hash + ".png"
+
+
+def draw_graph_picture(graph_dict, picture_path):
+    "Draws a graph, as stored in a graphs file, with its nodes at their grid positions"
+    graph = nx.Graph()
+    labels = None
+    if graph_dict["Graph_Type"] == "named_graph":
+        labels = graph_dict["Mapping"]
+        if graph_dict["Ambiguity"] == None:
+            name_to_node = {name: node for node, name in labels.items()}
+        else:
+            name_to_node = {f"{name}_{node}": node for node, name in labels.items()}
+        graph.add_nodes_from(labels)
+        graph.add_edges_from((name_to_node[edge[0]], name_to_node[edge[1]]) for edge in graph_dict["Graph_Edges"])
+    else:
+        graph.add_nodes_from(graph_dict["Graph_Nodes"])
+        graph.add_edges_from(graph_dict["Graph_Edges"])
+    fig, ax = plt.subplots()
+    nx.draw_networkx(graph, pos={n: n for n in graph.nodes()}, labels=labels, with_labels=True, ax=ax)
+    fig.savefig(picture_path)
+    plt.close(fig)
+    return picture_path
+
+
+def _init_render_worker():
+    plt.switch_backend("Agg")
+
+
+def render_graph_pictures(graph_dicts, images_directory, workers=None):
+    """
+    Renders the pictures of the given graphs in a process pool (Agg backend).
+    Pictures that already exist in images_directory are skipped; returns the paths of the newly rendered ones.
+    """
+    os.makedirs(images_directory, exist_ok=True)
+    pending = {}
+    for graph_dict in graph_dicts:
+        picture_path = os.path.join(images_directory, graph_dict["Picture_Name"])
+        if picture_path not in pending and not exists(picture_path):
+            pending[picture_path] = graph_dict
+    if not pending:
+        return []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker) as executor:
+        return list(executor.map(draw_graph_picture, pending.values(), pending.keys(), chunksize=8))
@@ -17,7 +17,7 @@ logger = getLogger(__name__)
 import sys
 import os
 sys.path.append(os.path.abspath('../clemgames/textmapworld'))
-from textmapworld_utils import loop_identification, get_directions, string_available_directions, have_common_element, get_nextnode_label, calculate_similarity, create_graph
+from textmapworld_utils import loop_identification, string_available_directions, have_common_element, get_move_index, calculate_similarity, create_graph
 
 
 INVALID = 0
@@ -41,8 +41,7 @@ class PathDescriber(Player):
         super().__init__(model_name)
         self.graph_type = game_instance['Game_Type']
         self.ambiguity = game_instance["Ambiguity"]
-        self.moves =ast.literal_eval(game_instance['Moves'])
-        self.directions = ast.literal_eval(game_instance['Directions'])
+        self.move_index = get_move_index(game_instance)
         self.move_construction =  game_instance["Move_Construction"] 
         self.stop_construction = game_instance["Stop_Construction"]
         self.nodes = ast.literal_eval(game_instance['Graph_Nodes'])
@@ -57,8 +56,8 @@ class PathDescriber(Player):
         self.current_node = game_instance["Current_Position"]
         self.visited_nodes.append(self.current_node)
 
-    def check_path_answer(self, utterance: str, directions: List[str], node, saved_node) -> List[Dict]:
-        previous_direction = get_directions(node, directions, saved_node)
+    def check_path_answer(self, utterance: str, node) -> List[Dict]:
+        previous_direction = self.move_index.get_directions(node)
         previous_dirrection_changed =  string_available_directions(previous_direction) 
         previous_dirrection_no_pq = string_utils.remove_punctuation(previous_dirrection_changed)
         if not have_common_element(utterance, previous_dirrection_no_pq):
@@ -71,19 +70,20 @@ class PathDescriber(Player):
         "Check if the direction is valid"
         the_last_node= self.visited_nodes[-1]
         self.old_node = the_last_node
-        errors = self.check_path_answer(utterance, self.directions, the_last_node, self.old_node)
+        errors = self.check_path_answer(utterance, the_last_node)
         if errors:
             error = errors[0]
             self.game_error = error
-            self.directions_next_node = get_directions(the_last_node, self.directions, the_last_node)    
+            self.directions_next_node = self.move_index.get_directions(the_last_node)    
             self.directions_next_node = string_available_directions(self.directions_next_node)
             return "not valid"
         else:
-            next_node_label, self.move_type = get_nextnode_label(self.moves, the_last_node, utterance, self.move_construction)
+            next_node_label = self.move_index.get_next_node(the_last_node, utterance)
+            self.move_type = utterance.strip()
             self.current_node = next_node_label
             if next_node_label in self.nodes:
                 self.visited_nodes.append(next_node_label)
-                list_directions_nextnode= get_directions(next_node_label, self.directions, self.current_node)
+                list_directions_nextnode= self.move_index.get_directions(next_node_label)
                 self.directions_next_node = string_available_directions(list_directions_nextnode)
                 return True
             
@@ -150,7 +150,7 @@ class Graphreasoning(DialogueGameMaster):
         self.graph_type = game_instance['Game_Type']
         self.initial_position = game_instance["Current_Position"]
         self.playerA_initial_prompt = game_instance["Prompt"]
-        self.directions = ast.literal_eval(game_instance['Directions'])
+        self.move_index = get_move_index(game_instance)
         self.ambiguity = game_instance["Ambiguity"]
         self.move_construction =  game_instance["Move_Construction"] 
         self.stop_construction = game_instance["Stop_Construction"]
@@ -173,7 +173,7 @@ class Graphreasoning(DialogueGameMaster):
             if self.ambiguity != None:
                 initial_directions = self.initial_position.split("_")[0]
             self.playerA_initial_prompt = self.playerA_initial_prompt.replace("$INITIAL_ROOM$", initial_directions)
-        self.initial_directions= get_directions(self.initial_position, self.directions, self.initial_position)
+        self.initial_directions= self.move_index.get_directions(self.initial_position)
         self.changed_initial_directions = string_available_directions(self.initial_directions)
         self.playerA_initial_prompt = self.playerA_initial_prompt.replace("$INITIAL_DIRECTIONS$",self.changed_initial_directions)
         self.add_user_message(self.guesser, self.playerA_initial_prompt)
@@ -301,23 +301,25 @@ class GraphGameScorer(GameScorer):
         new_edges = [(edge[1], edge[0]) for edge in self.old_edges]
         new_edges.extend(self.old_edges)
         self.edges = new_edges
+        self.move_index = get_move_index(game_instance)
         self.start = game_instance["Current_Position"]
         self.mapping = ast.literal_eval(game_instance['Mapping'])
         self.graph_data = {}
+        self.original_graph = None
 
     
     def visited_all(self, visited, to_visit):
         return all([n in visited for n in to_visit])
     
     def get_available_moves(self, node):
-        return [edge for edge in self.edges if node == edge[0]]
+        return self.move_index.get_available_moves(node)
     
     def adj(self, node):
-        return set([ed[1] for ed in self.edges if ed[0] == node])
+        return self.move_index.adj(node)
     
     def find_best_moves(self, current, visited):
         
-        to_visit = [ed[1] for ed in self.edges if ed[0] in visited and ed[1] not in visited]
+        to_visit = [neighbour for node in visited for neighbour in self.move_index.adj(node) if neighbour not in visited]
         start = [current]
         q = Queue()
         q.put(start)
@@ -406,10 +408,11 @@ class GraphGameScorer(GameScorer):
                         self.graph_data["goal"] = self.mapping
                         self.graph_data[count_graphs]= {}
                         cont = ast.literal_eval(action['content'])
-                        G1= create_graph(self.nodes, self.edges, "original")
+                        if self.original_graph is None:
+                            self.original_graph = create_graph(self.nodes, self.edges, "original")
                         G2= create_graph(cont['nodes'], cont['edges'], "generated")
                         self.graph_data[count_graphs]["generated"] = cont
-                        similarity_percent = calculate_similarity(G1, G2)*100
+                        similarity_percent = calculate_similarity(self.original_graph, G2, labeled=self.game_type == "named_graph")*100
                         self.graph_data[count_graphs]["similarity"] = similarity_percent
                         graphs_similarity.append(similarity_percent)
                         graphs.append(cont)
@@ -8,7 +8,7 @@ import os
 import random
 
 sys.path.append(os.path.abspath('../clemgames/textmapworld'))
-from textmapworld_utils import load_check_graph, generate_filename, create_graphs_file
+from textmapworld_utils import load_check_graph, generate_filename, create_graphs_file, render_graphs_file_pictures
 
 
 
@@ -19,6 +19,7 @@ SEED = 42
 
 strict = True
 create_new_graphs = False # True or False   !if True, the graphs will be created again, threfore pay attention!
+render_pictures = True # True or False   if False, the graph pictures are not rendered (existing pictures are always kept)
 n = 4
 m = 4
 instance_number = 10
@@ -74,6 +75,8 @@ class GraphGameInstanceGenerator(GameInstanceGenerator):
                 if os.path.exists(file_graphs):
                     raise ValueError("The file already exists, please set create_new_graphs to False.")
                 create_graphs_file(file_graphs, instance_number, game_type, n, m, size, cycle_type, ambiguity, game_name)
+                if render_pictures:
+                    render_graphs_file_pictures(file_graphs, game_name)
 
             if os.path.exists(file_graphs):
                 grids = load_check_graph(file_graphs, instance_number, game_type)
@@ -5,9 +5,8 @@ from clemcore.clemgame import GameInstanceGenerator
 import sys
 import os
 sys.path.append(os.path.abspath('../clemgames/textmapworld'))
-from textmapworld_utils import load_check_graph, generate_filename, create_graphs_file, create_graph_specificroom
+from textmapworld_utils import load_check_graph, generate_filename, create_graphs_file, render_graphs_file_pictures, DistanceTable
 import random
-import networkx as nx
 
 "Enter the parameters for the game instance generator"
 "-------------------------------------------------------------------------------------------------------------"
@@ -17,6 +16,7 @@ SEED = 42
 
 strict = True
 create_new_graphs = False # True or False   !if True, the graphs will be created again, threfore pay attention!
+render_pictures = True # True or False   if False, the graph pictures are not rendered (existing pictures are always kept)
 size = 8        #"large"
 n = 4
 m = 4
@@ -61,6 +61,8 @@ class GraphGameInstanceGenerator(GameInstanceGenerator):
             if os.path.exists(file_graphs):
                 raise ValueError("The file already exists, please set create_new_graphs to False.")
             create_graphs_file(file_graphs, instance_number, game_type, n, m, size, cycle_type, ambiguity, game_name)
+            if render_pictures:
+                render_graphs_file_pictures(file_graphs, game_name)
         game_id = 0
         player_a_prompt_header =  self.load_template(prompt_file_name)
         Player2_positive_answer = answers_file["PositiveAnswerNamedGame"] 
@@ -93,26 +95,19 @@ class GraphGameInstanceGenerator(GameInstanceGenerator):
                     game_instance["Max_Turns_Reminder_Text"] = reminders_file["max_turns_reminder"]
                     game_instance["Mapping"] = str(grid["Mapping"])
                     game_instance["Strict"] = strict
-                    generated_graph = create_graph_specificroom(grid["Graph_Nodes"], grid["Graph_Edges"])
-                    dists = dict(nx.all_pairs_shortest_path_length(generated_graph))
+                    distance_table = DistanceTable(grid["Graph_Nodes"], grid["Graph_Edges"])
                     random_distance = random.choice(value)
-                    distance_found = False
-                    for k,v in dists.items():
-                        if k == grid["Initial_Position"]:
-                            for neighbor, distance in v.items():
-                                if distance == random_distance:
-                                    game_instance["Specific_Room"] = neighbor
-                                    game_instance["Specific_Room_Distance"] = str(random_distance)
-                                    distance_found = True
-                                    break
-                    if not distance_found:
-                        for room, val in dists.items():
-                            for neighbor, distance in val.items():
-                                if distance == random_distance:
-                                    game_instance['Current_Position'] = room
-                                    game_instance["Specific_Room"] = neighbor
-                                    game_instance["Specific_Room_Distance"] = str(random_distance)
-                                    break
+                    rooms_at_distance = distance_table.nodes_at_distance(grid["Initial_Position"], random_distance)
+                    if not rooms_at_distance:
+                        # no room at that distance from the initial position, so the initial position is moved
+                        for room in reversed(distance_table.nodes):
+                            rooms_at_distance = distance_table.nodes_at_distance(room, random_distance)
+                            if rooms_at_distance:
+                                game_instance['Current_Position'] = room
+                                break
+                    if rooms_at_distance:
+                        game_instance["Specific_Room"] = rooms_at_distance[0]
+                        game_instance["Specific_Room_Distance"] = str(random_distance)
                         
 
 if __name__ == '__main__':
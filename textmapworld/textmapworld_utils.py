@@ -1,8 +1,15 @@
 import ast
+import json
 import os
 import random
+import sys
+from functools import lru_cache
+import numpy as np
 import networkx as nx
-from graph_generator import GraphGenerator
+from graph_generator import GraphGenerator, render_graph_pictures
+# DistanceTable lives in a module without dependencies on the games, textmapworld_questions uses it too
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from graph_distances import DistanceTable
 
 "----------------------------------------------------"
 "The functions used in instance_generator.py"
@@ -22,23 +29,96 @@ def generate_filename(game_type, graph_size, cycle_type, ambiguity):
     return filename
 
 
+GRAPH_POOL_FORMAT = "textmapworld_graph_pool"
+GRAPH_POOL_VERSION = 1
+
+def graph_type_of(graph):
+    "named_graph or unnamed_graph, depending on the type of the graph's nodes"
+    nodes = graph.get('Graph_Nodes', [])
+    if all(isinstance(item, tuple) for item in nodes):
+        return "unnamed_graph"
+    elif all(isinstance(item, str) for item in nodes):
+        return "named_graph"
+    return None
+
+
+class GraphPool:
+    """
+    Streaming reader for a graphs file: an optional JSON header line (format, version, graph type, count)
+    followed by one graph literal per line. Only the graphs that are requested are parsed;
+    files written before the header existed are read as well.
+    """
+
+    def __init__(self, file_graphs):
+        self.file_graphs = str(file_graphs)
+        self.header = None
+        self.data_start = 0
+        self._offsets = None
+        with open(self.file_graphs, 'rb') as file:
+            first_line = file.readline()
+        try:
+            header = json.loads(first_line)
+        except ValueError:
+            header = None
+        if isinstance(header, dict) and header.get("format") == GRAPH_POOL_FORMAT:
+            if header.get("version") != GRAPH_POOL_VERSION:
+                raise ValueError(f"Unsupported graph pool version {header.get('version')}")
+            self.header = header
+            self.data_start = len(first_line)
+
+    @property
+    def graph_type(self):
+        return self.header["graph_type"] if self.header else None
+
+    def read(self, number=None):
+        "Yields the first number graphs (all graphs if number is None) without reading further"
+        if number is not None and number <= 0:
+            return
+        with open(self.file_graphs, 'rb') as file:
+            file.seek(self.data_start)
+            count = 0
+            for line in file:
+                line = line.rstrip()
+                if not line:
+                    continue
+                yield ast.literal_eval(line.decode("utf-8"))
+                count += 1
+                if number is not None and count >= number:
+                    break
+
+    def offsets(self):
+        "Byte offsets of the graph lines, collected once without parsing the graphs"
+        if self._offsets is None:
+            self._offsets = []
+            with open(self.file_graphs, 'rb') as file:
+                file.seek(self.data_start)
+                position = self.data_start
+                for line in file:
+                    if line.strip():
+                        self._offsets.append(position)
+                    position += len(line)
+        return self._offsets
+
+    def __len__(self):
+        if self.header and "count" in self.header:
+            return self.header["count"]
+        return len(self.offsets())
+
+    def __getitem__(self, index):
+        offset = self.offsets()[index]
+        with open(self.file_graphs, 'rb') as file:
+            file.seek(offset)
+            return ast.literal_eval(file.readline().rstrip().decode("utf-8"))
+
+
 def load_check_graph(file_graphs, instance_number, game_type):
-    grids = []
-    with open(str(file_graphs), 'r') as file:
-        for c, line in enumerate(file):
-            line = line.rstrip()
-            doc = ast.literal_eval(line)
-            nodes = doc.get('Graph_Nodes', [])
-            check_set = set()
-            if c < instance_number:
-                if all(isinstance(item, tuple) for item in nodes):
-                    checked_graph_type = "unnamed_graph"
-                    check_set.add(checked_graph_type)
-                elif all(isinstance(item, str) for item in nodes):
-                    checked_graph_type = "named_graph"
-                    check_set.add(checked_graph_type)
-                grids.append(doc)
-        if  check_set != {str(game_type)}:
+    pool = GraphPool(file_graphs)
+    if pool.graph_type is not None and pool.graph_type != str(game_type):
+        raise ValueError("Graph type does not match the specified type")
+    grids = list(pool.read(instance_number))
+    if pool.graph_type is None:
+        # no header, so the graph type has to be checked on the graphs themselves
+        if not grids or any(graph_type_of(grid) != str(game_type) for grid in grids):
             raise ValueError("Graph type does not match the specified type")
     return grids
 
@@ -48,7 +128,8 @@ def create_graphs_file(graphs_file_name, num_graphs, graph_type, n, m, rooms, cy
     
     generated_graphs = 0
     with open(graphs_file_name, "w") as f:
-        file_length = os.path.getsize(graphs_file_name)
+        header = {"format": GRAPH_POOL_FORMAT, "version": GRAPH_POOL_VERSION, "graph_type": graph_type, "count": num_graphs}
+        f.write(json.dumps(header) + "\n")
         while generated_graphs < num_graphs:
             new_instance = GraphGenerator(graph_type, n, m, rooms, cycle_bool, abiguity, game_name)
             result = new_instance.generate_instance()
@@ -56,10 +137,16 @@ def create_graphs_file(graphs_file_name, num_graphs, graph_type, n, m, rooms, cy
                 f.write(str(result) + "\n")
                 generated_graphs+=1
     # Check if file is empty
-    if os.path.getsize(graphs_file_name) == 0:
+    if generated_graphs == 0:
         raise ValueError("Generated file is empty")
     return graphs_file_name
 
+def render_graphs_file_pictures(graphs_file_name, game_name, workers=None):
+    "Renders the missing pictures of the graphs in a graphs file, separately from the graph generation"
+    graph_dicts = GraphPool(graphs_file_name).read()
+    images_directory = os.path.join("..", "clemgames", "textmapworld", game_name, "resources", "images")
+    return render_graph_pictures(graph_dicts, images_directory, workers)
+
 "----------------------------------------------------"
 "The functions used in master.py"
 
@@ -132,6 +219,56 @@ def ambiguity_move(old_one, new_one, mapping, moves, move_type):
                                         if s[0] == move_type:
                                             return label, s[1]
                                         
+class MoveIndex:
+    """
+    Lookup tables for a single graph instance, built once from its Directions, Moves and Graph_Edges:
+    node -> available directions, node -> {direction -> neighbour} and node -> neighbours.
+    Replaces the per-turn scans of get_directions(_main) and get_nextnode_label.
+    """
+
+    def __init__(self, directions, moves, edges, graph_type):
+        self.graph_type = graph_type
+        self.node_directions = {}
+        self.lowered_directions = {}
+        for node, node_directions in directions:
+            # the first entry wins, like the linear scan in get_directions_main
+            self.node_directions.setdefault(node, node_directions)
+            if graph_type == "named_graph":
+                self.lowered_directions.setdefault(node.lower(), node_directions)
+        self.node_moves = {}
+        for move in moves:
+            self.node_moves[move["node"]] = dict(move["node_moves"])
+        self.neighbours = {}
+        for edge in edges:
+            self.neighbours.setdefault(edge[0], []).append(edge[1])
+            self.neighbours.setdefault(edge[1], []).append(edge[0])
+        self.neighbour_sets = {node: set(nodes) for node, nodes in self.neighbours.items()}
+
+    def get_directions(self, node):
+        node_directions = self.node_directions.get(node)
+        if node_directions is None and self.graph_type == "named_graph" and isinstance(node, str):
+            node_directions = self.lowered_directions.get(node.lower())
+        return node_directions
+
+    def get_next_node(self, node, direction):
+        return self.node_moves.get(node, {}).get(direction.strip())
+
+    def get_available_moves(self, node):
+        return [(node, neighbour) for neighbour in self.neighbours.get(node, [])]
+
+    def adj(self, node):
+        return self.neighbour_sets.get(node, set())
+
+
+@lru_cache(maxsize=1024)
+def _cached_move_index(directions, moves, edges, graph_type):
+    return MoveIndex(ast.literal_eval(directions), ast.literal_eval(moves), ast.literal_eval(edges), graph_type)
+
+def get_move_index(game_instance):
+    "Returns the MoveIndex of a game instance; the game master, the describer and the scorer share one object"
+    return _cached_move_index(game_instance["Directions"], game_instance["Moves"],
+                              game_instance["Graph_Edges"], game_instance["Game_Type"])
+
 def loop_identification(visited_nodes):
     if len(visited_nodes) >= 4:
         if len(set(visited_nodes[-4:])) < 3:
@@ -143,13 +280,14 @@ def loop_identification(visited_nodes):
 
 # Function to get nodes at a certain distance from the initial node
 def get_nodes_at_distance(graph, initial_node, distance):
-    return [node for node in nx.single_source_shortest_path_length(graph, initial_node) if nx.single_source_shortest_path_length(graph, initial_node)[node] == distance]
+    return DistanceTable.from_graph(graph).nodes_at_distance(initial_node, distance)
 
 # Randomly select nodes at various distances from the initial node
 def select_nodes_at_distances(G, initial_position, max_distance):
     chosen_nodes = {}
+    distance_table = DistanceTable.from_graph(G)
     for distance in range(max_distance):
-        nodes_at_distance = get_nodes_at_distance(G, initial_position, distance)
+        nodes_at_distance = distance_table.nodes_at_distance(initial_position, distance)
         if nodes_at_distance:
             random_node = random.choice(nodes_at_distance)
             chosen_nodes[str(distance)] = random_node
@@ -192,8 +330,57 @@ def normalize(distance):
         normalized_distance = 2*(normalized_distance - 0.5)
         return normalized_distance
     
-def calculate_similarity(graph1, graph2):
-    distance = nx.graph_edit_distance(graph1, graph2)
+EXACT_GED_MAX_NODES = 8 # above this size the exact graph edit distance is not attempted
+GED_TIMEOUT = 5 # seconds spent on a single (unlabeled) graph edit distance
+
+def canonical_graph(graph):
+    "Hashable, order independent form of an undirected graph"
+    nodes = frozenset(graph.nodes())
+    edges = frozenset(frozenset(edge) for edge in graph.edges())
+    return nodes, edges
+
+def labeled_edit_distance(canonical1, canonical2):
+    "With named rooms the node matching is given, so the edit distance is the size of the node and edge symmetric differences"
+    nodes1, edges1 = canonical1
+    nodes2, edges2 = canonical2
+    return len(nodes1 ^ nodes2) + len(edges1 ^ edges2)
+
+def _graph_from_canonical(canonical):
+    nodes, edges = canonical
+    G = nx.Graph()
+    G.add_nodes_from(nodes)
+    G.add_edges_from(tuple(edge) if len(edge) == 2 else (next(iter(edge)),) * 2 for edge in edges)
+    return G
+
+@lru_cache(maxsize=4096)
+def _cached_edit_distance(canonical1, canonical2, labeled):
+    if canonical1 == canonical2:
+        return 0
+    # the labeled distance is an edit path under the identity matching, hence always an upper bound
+    upper_bound = labeled_edit_distance(canonical1, canonical2)
+    if labeled:
+        return upper_bound
+    graph1 = _graph_from_canonical(canonical1)
+    graph2 = _graph_from_canonical(canonical2)
+    if max(len(canonical1[0]), len(canonical2[0])) <= EXACT_GED_MAX_NODES:
+        distance = nx.graph_edit_distance(graph1, graph2, upper_bound=upper_bound, timeout=GED_TIMEOUT)
+        return upper_bound if distance is None else min(distance, upper_bound)
+    # same search as nx.optimize_graph_edit_distance, but stopped after GED_TIMEOUT
+    best = upper_bound
+    for _, _, distance in nx.optimize_edit_paths(graph1, graph2, upper_bound=upper_bound, timeout=GED_TIMEOUT):
+        best = min(best, distance)
+    return best
+
+def graph_edit_distance(graph1, graph2, labeled=False):
+    """
+    Bounded graph edit distance, memoized by the canonical form of both graphs across turns and episodes.
+    Labeled graphs use the symmetric difference shortcut, small unlabeled graphs the exact distance and
+    larger ones the best upper bound found by the optimize_graph_edit_distance search within GED_TIMEOUT.
+    """
+    return _cached_edit_distance(canonical_graph(graph1), canonical_graph(graph2), labeled)
+
+def calculate_similarity(graph1, graph2, labeled=False):
+    distance = graph_edit_distance(graph1, graph2, labeled)
     normalized_distance = normalize(distance)
     similarity = 1 - normalized_distance
     return similarity
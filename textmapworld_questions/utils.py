@@ -1,9 +1,11 @@
 import ast
 import os
+from functools import lru_cache
 import numpy as np
 import networkx as nx 
 from clemgame import  string_utils
 from games.textmapworld_questions.graph_generator import GraphGenerator
+from games.graph_distances import DistanceTable
 
 "----------------------------------------------------"
 "The functions used in instance_generator.py"
@@ -126,15 +128,19 @@ def loop_identification(visited_nodes):
     return False
 
 
+@lru_cache(maxsize=1024)
+def distance_table(nodes, edges):
+    "All-pairs BFS distances of a graph, shared by the repeated questions about the same graph"
+    return DistanceTable(nodes, edges)
+
 def calculate_distance(nodes, edges, node1, node2):
-    graph = nx.Graph()
-    graph.add_nodes_from(nodes)
-    graph.add_edges_from(edges)
-    try:
-        distance = nx.shortest_path_length(graph, source=node1, target=node2)
-        return distance
-    except nx.NetworkXNoPath:
+    table = distance_table(tuple(nodes), tuple(tuple(edge) for edge in edges))
+    if node1 not in table.node_index or node2 not in table.node_index:
+        raise nx.NodeNotFound(f"Node {node1 if node1 not in table.node_index else node2} not in graph")
+    distance = table.distance(node1, node2)
+    if distance is None:
         return "No path exists between the nodes"
+    return distance
     
 def count_word_in_sentence(sentence, word):
     # Split the sentence into words